@@ -3,14 +3,20 @@ import asyncio
 import time
 from google.adk import Agent
 from google.adk.runners import Runner
-from google.adk.sessions.in_memory_session_service import InMemorySessionService
 from google.genai import types
 
+from . import tools
+from .pipeline import get_mode, run_pipeline, usage_delta
+from .metrics import RUNS, observe_run
+from .session_store import BoundedSessionService
+from .tracing import span
+# Async versions of the tools, so calls the model issues in one turn run concurrently
 from .tools import (
-    analyze_pr_vulnerabilities,
-    fix_code_vulnerability,
-    commit_and_push_fixes,
-    comment_on_pr
+    analyze_pr_vulnerabilities_async,
+    fix_code_vulnerability_async,
+    fix_file_vulnerabilities_async,
+    commit_and_push_fixes_async,
+    comment_on_pr_async
 )
 
 # Instruction for the Security Guardian Agent
@@ -19,10 +25,12 @@ You are the "🛡️ Guardian Agent", an AI-powered security expert.
 Your goal is to protect repositories by surgically fixing security vulnerabilities identified in Pull Requests.
 
 Workflow:
-1. Call 'analyze_pr_vulnerabilities' to find issues in the PR.
-2. If vulnerabilities are found, for EACH issue in the 'issues' list:
-   - Call 'fix_code_vulnerability' with the EXACT filename, line_number, and issue_text from that specific issue.
-   - Do NOT combine fixes or hallucinate issues not found by the analysis tool.
+1. Call 'analyze_pr_vulnerabilities' to find issues in the PR. Pass the base branch when one is given so only the PR's changes are analyzed.
+2. If vulnerabilities are found, group the 'issues' list by filename. For EACH file:
+   - Call 'fix_file_vulnerabilities' once with the EXACT filename and that file's issues (line_number, issue_text, test_id).
+   - Issue the 'fix_file_vulnerabilities' calls for ALL files in the same turn; they run in parallel.
+   - Use 'fix_code_vulnerability' only to retry a single issue that was not fixed.
+   - Do NOT hallucinate issues not found by the analysis tool.
 3. Once all fixes are applied, call 'commit_and_push_fixes' with the 'fixed_files' (comma-separated string).
 4. Finally, call 'comment_on_pr' to report progress.
 
@@ -38,39 +46,91 @@ guardian_agent = Agent(
     description="Analyzes and fixes security vulnerabilities in Pull Requests.",
     instruction=SECURITY_INSTRUCTIONS,
     tools=[
-        analyze_pr_vulnerabilities,
-        fix_code_vulnerability,
-        commit_and_push_fixes,
-        comment_on_pr
+        analyze_pr_vulnerabilities_async,
+        fix_code_vulnerability_async,
+        fix_file_vulnerabilities_async,
+        commit_and_push_fixes_async,
+        comment_on_pr_async
     ],
     model="gemini-2.5-flash"
 )
 
-# Global runner initialization
-session_service = InMemorySessionService()
+# Global runner initialization. Sessions are bounded in number and age so a
+# long-running server does not keep the event history of every PR it processed
+APP_NAME = "GuardianApp"
+USER_ID = "guardian_system"
+session_service = BoundedSessionService.from_env()
 runner = Runner(
-    app_name="GuardianApp",
+    app_name=APP_NAME,
     agent=guardian_agent,
     session_service=session_service,
     auto_create_session=True
 )
 
-async def run_guardian_on_pr(repo_url: str, repo_owner: str, repo_name: str, pr_number: int, branch_name: str):
+async def run_guardian_on_pr(repo_url: str, repo_owner: str, repo_name: str, pr_number: int, branch_name: str,
+                             base_branch: str = "", should_cancel=None, mode: str = None):
     """
-    Executes the ADK Agent to process a specific Pull Request.
+    Processes a specific Pull Request and returns a run summary.
+
+    mode (or GUARDIAN_MODE): "pipeline" (default) runs the steps directly in
+    code and only calls the LLM for fixes; "agent" lets the ADK Agent plan
+    every tool call.
+
+    should_cancel is an optional callable checked between agent events; when it
+    returns True (e.g. a newer push superseded this head) the run stops early.
     """
+    mode = get_mode(mode)
+    with span("pr.run", mode=mode, repo=repo_name, pr=pr_number) as s:
+        try:
+            if mode == "pipeline":
+                summary = await run_pipeline(repo_url, repo_owner, repo_name, pr_number, branch_name,
+                                             base_branch, should_cancel)
+            else:
+                summary = await _run_agent(repo_url, repo_owner, repo_name, pr_number, branch_name,
+                                           base_branch, should_cancel)
+        except Exception:
+            RUNS.inc(mode=mode, outcome="error")
+            raise
+        s.set(calls=summary.get("calls"), prompt_tokens=summary.get("prompt_tokens"),
+              output_tokens=summary.get("output_tokens"), error=summary.get("error"))
+    observe_run(summary)
+    return summary
+
+async def _run_agent(repo_url, repo_owner, repo_name, pr_number, branch_name, base_branch="", should_cancel=None):
     print(f" [ADK Agent] Starting security run for PR #{pr_number} in {repo_name}...")
+    started = time.perf_counter()
+    before = tools.llm.usage_snapshot()
+    # Planning turns of the agent model, on top of the fix-generation calls counted by the LLM client
+    planning = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0}
+    summary = {"mode": "agent", "cancelled": False}
     
     # We provide the initial signal to the agent
     prompt = f"Process PR #{pr_number} in repo '{repo_name}' (owned by {repo_owner}). Clone URL: {repo_url}. Branch: {branch_name}."
+    if base_branch:
+        prompt += f" Base branch: {base_branch}."
     
+    # comment_on_pr adds to this run's status comment; it is written when the run ends
+    tools.gitea_client.status_comment(repo_owner, repo_name, pr_number, new_run=True)
+
     # Run the agent using the Runner
+    session_id = f"pr_{pr_number}_{int(time.time())}"
     try:
         async for event in runner.run_async(
-            user_id="guardian_system",
-            session_id=f"pr_{pr_number}_{int(time.time())}",
+            user_id=USER_ID,
+            session_id=session_id,
             new_message=types.Content(parts=[types.Part(text=prompt)])
         ):
+            if should_cancel and should_cancel():
+                print(f" [ADK Agent] PR #{pr_number} head was superseded by a newer push. Stopping run.")
+                summary["cancelled"] = True
+                break
+
+            usage = getattr(event, "usage_metadata", None)
+            if usage is not None:
+                planning["calls"] += 1
+                planning["prompt_tokens"] += getattr(usage, "prompt_token_count", None) or 0
+                planning["output_tokens"] += getattr(usage, "candidates_token_count", None) or 0
+
             if event.content:
                 # Safely extract text from the content parts
                 parts = getattr(event.content, 'parts', [])
@@ -96,5 +156,24 @@ async def run_guardian_on_pr(repo_url: str, repo_owner: str, repo_name: str, pr_
                     
     except Exception as e:
         print(f" [ADK Agent] Runtime error: {e}")
+        summary["error"] = str(e)
         import traceback
         traceback.print_exc()
+    finally:
+        await session_service.release(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+        # Only shown on its own when it replaces an earlier run's status
+        if summary["cancelled"]:
+            final = "⏹️ Superseded by a newer push; this run stopped early."
+        elif summary.get("error"):
+            final = f"❌ Agent run failed: {summary['error']}"
+        else:
+            final = f"ℹ️ Finished checking `{branch_name}`."
+        await asyncio.to_thread(tools.gitea_client.close_status, repo_owner, repo_name, pr_number, final)
+
+    fixing = usage_delta(before, tools.llm.usage_snapshot())
+    summary.update({key: fixing[key] + planning[key] for key in planning})
+    summary["planning_calls"] = planning["calls"]
+    summary["seconds"] = time.perf_counter() - started
+    print(f" [ADK Agent] PR #{pr_number} done in {summary['seconds']:.1f}s, {summary['calls']} LLM call(s) "
+          f"({planning['calls']} planning).")
+    return summary
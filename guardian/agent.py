@@ -1,17 +1,23 @@
 import os
 import time
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from .git_ops import GitOps
-from .analyzer import Analyzer
+from .analyzer import Analyzer, AnalysisError
 from .llm_client import LLMClient
 from .gitea_client import GiteaClient
+from .context import extract_context
+from .llm_client import format_search_replace_blocks, parse_search_replace_blocks
+from .validation import FileFix, FixValidator
+from .tracing import bind, span
 
 class SecurityAgent:
-    def __init__(self):
-        self.git_ops = GitOps()
-        self.analyzer = Analyzer()
-        self.llm = LLMClient()
-        self.gitea = GiteaClient()
+    def __init__(self, git_ops=None, analyzer=None, llm=None, gitea=None):
+        # Components can be shared with other orchestrators (see pipeline.py)
+        self.git_ops = git_ops or GitOps()
+        self.analyzer = analyzer or Analyzer()
+        self.llm = llm or LLMClient()
+        self.gitea = gitea or GiteaClient()
+        self.validator = FixValidator(self.analyzer)
 
     def process_pr(self, pr_data):
         """
@@ -22,89 +28,170 @@ class SecurityAgent:
         repo_owner_name = pr_data['repository']['owner']['username']
         pr_number = pr_data['number']
         branch_name = pr_data['pull_request']['head']['ref']
-        
-        print(f"Processing PR #{pr_number} in {repo_name}...")
+        base_branch = pr_data['pull_request'].get('base', {}).get('ref')
+        return self.run_pr(repo_url, repo_owner_name, repo_name, pr_number, branch_name, base_branch)
 
-        # 1. Clone Repo into unique directory to avoid lock issues on Windows
-        repo_dir = f"{repo_name}_pr{pr_number}_{int(time.time())}"
-        repo, repo_path = self.git_ops.clone_repo(repo_url, repo_dir)
-        self.git_ops.checkout_branch(repo, branch_name)
+    def run_pr(self, repo_url, repo_owner_name, repo_name, pr_number, branch_name, base_branch=None,
+               should_cancel=None):
+        """
+        Runs analyze -> fix -> validate -> commit -> comment for one PR.
+        Returns a summary with the outcome and per-stage timings.
 
-        # 2. Analyze (Bandit)
-        issues = self.analyzer.run_bandit(repo_path)
-        
-        if isinstance(issues, dict) and "error" in issues:
-            print(f"Analysis failed: {issues['error']}")
-            return
+        should_cancel is an optional callable checked between stages and
+        files; when it returns True the run stops without pushing.
+        """
+        print(f"Processing PR #{pr_number} in {repo_name}...")
+        summary = {"issues": 0, "fixed_files": [], "cancelled": False, "timings": {}}
 
-        if not issues:
-            print("No security issues found.")
-            return
+        # One status comment per PR, edited as the run progresses
+        self.gitea.status_comment(repo_owner_name, repo_name, pr_number, new_run=True)
+        final = None
+        with span("pipeline.run", repo=repo_name, pr=pr_number, branch=branch_name) as s:
+            try:
+                # 1. Clone Repo into unique directory to avoid lock issues on Windows
+                started = time.perf_counter()
+                repo_dir = f"{repo_name}_pr{pr_number}_{int(time.time())}"
+                try:
+                    repo, repo_path = self.git_ops.clone_repo(repo_url, repo_dir)
+                    self.git_ops.checkout_branch(repo, branch_name)
+                except Exception as e:
+                    final = f"❌ Could not check out `{branch_name}`: {e}"
+                    raise
+                head = repo.head.commit.hexsha[:10]
+                summary["timings"]["clone"] = time.perf_counter() - started
 
-        print(f"Found {len(issues)} issues. Starting fix cycle...")
-        self.gitea.post_comment(repo_owner_name, repo_name, pr_number, 
-                                f"🛡️ **Guardian Agent** found {len(issues)} security issues. Attempting fixes...")
+                try:
+                    self._fix_pr(repo, repo_path, repo_owner_name, repo_name, pr_number, branch_name, base_branch,
+                                 should_cancel, summary)
+                finally:
+                    self.git_ops.cleanup(repo_path)
+                final = self._final_status(summary, head)
+            finally:
+                self.gitea.close_status(repo_owner_name, repo_name, pr_number, final)
+            s.set(issues=summary["issues"], fixed_files=len(summary["fixed_files"]),
+                  cancelled=summary["cancelled"], error=summary.get("error"))
+        return summary
 
+    def _final_status(self, summary, head):
+        """
+        Last status line for runs that did not already end with one, so a
+        status left by an earlier push is never shown as current.
+        """
+        if summary["cancelled"]:
+            return f"⏹️ Superseded by a newer push; stopped checking {head}."
+        if summary.get("error") or summary["fixed_files"]:
+            return None
+        if not summary["issues"]:
+            return f"✅ No security issues found in {head}."
+        return f"⚠️ Found {summary['issues']} issue(s) in {head}, but no fix passed validation."
+
+    def _fix_pr(self, repo, repo_path, repo_owner_name, repo_name, pr_number, branch_name, base_branch=None,
+                should_cancel=None, summary=None):
+        summary = summary if summary is not None else {"timings": {}}
+        cancelled = should_cancel or (lambda: False)
+        status = self.gitea.status_comment(repo_owner_name, repo_name, pr_number)
+        started = time.perf_counter()
         fixed_files = []
-        
-        # 3. Fix Cycle
+        issue_count = 0
+
         try:
-            for issue in issues:
-                filename = issue['filename']
-                # Bandit returns distinct paths. usually relative to CWD if run with relative path.
-                
-                target_file = filename
-                if not os.path.exists(target_file):
-                    # Fallback: try joining
-                    target_file = os.path.join(repo_path, filename)
-                
-                if not os.path.exists(target_file):
-                    print(f"File not found: {target_file} (Original: {filename})")
+            # 2. Analyze (Bandit), scoped to the files the PR changed
+            files, changed_lines = self.git_ops.pr_scope(repo, base_branch)
+
+            # 3. Fix Cycle: findings stream in per file, and each file is handed
+            # to a fixer thread right away so LLM calls overlap the scan. Files
+            # are independent, so several are fixed at once under the shared rate limiter
+            with ThreadPoolExecutor(max_workers=int(os.getenv("GUARDIAN_LLM_CONCURRENCY", 4))) as fixer:
+                pending = []
+                for filename, file_issues in self.analyzer.iter_bandit(repo_path, files=files, changed_lines=changed_lines):
+                    if cancelled():
+                        break
+                    if not issue_count:
+                        print("Found security issues. Starting fix cycle...")
+                        status.update("Found security issues. Attempting fixes...")
+                    issue_count += len(file_issues)
+                    # Pool threads don't inherit the tracing context, so bind it per task
+                    pending.append(fixer.submit(bind(self._fix_issues), repo_path, file_issues))
+
+                fixes = [fix for fix in (future.result() for future in pending) if fix]
+            summary["issues"] = issue_count
+            summary["timings"]["analyze_and_fix"] = time.perf_counter() - started
+
+            if cancelled():
+                print(f"PR #{pr_number} was superseded by a newer push. Stopping before validation.")
+                summary["cancelled"] = True
+                return
+            if not issue_count:
+                print("No security issues found.")
+                return
+            print(f"Fix cycle complete for {issue_count} issues.")
+            started = time.perf_counter()
+
+            # 4. Verify all patched files together, reverting individual blocks that fail
+            for fix in self.validator.validate(repo_path, fixes):
+                if not fix.changed:
                     continue
+                self.llm.record_validated_fix(fix.issues, fix.original, format_search_replace_blocks(fix.kept))
+                # Git expects path relative to repo root
+                rel_path = os.path.relpath(fix.path, repo_path)
+                if rel_path not in fixed_files:
+                    fixed_files.append(rel_path)
+            summary["fixed_files"] = fixed_files
+            summary["timings"]["validate"] = time.perf_counter() - started
 
-                with open(target_file, 'r') as f:
-                    content = f.read()
-
-                print(f"Fixing {issue['issue_text']} in {filename}...")
-                
-                # Call LLM
-                fix_prompt = f"Fix the following security issue detected by Bandit:\n{issue}\nCode:\n"
-                fixed_code = self.llm.generate_fix(fix_prompt, content)
-                
-                # Apply Fix
-                with open(target_file, 'w') as f:
-                    f.write(fixed_code)
-                
-                # 4. Verify (Basic Syntax Check)
-                if self._validate_syntax(target_file):
-                    print(f"Fix for {filename} validated successfully.")
-                    # Git expects path relative to repo root
-                    rel_path = os.path.relpath(target_file, repo_path)
-                    if rel_path not in fixed_files:
-                        fixed_files.append(rel_path)
-                else:
-                    print(f"Fix for {filename} failed validation. Reverting...")
-                    with open(target_file, 'w') as f:
-                        f.write(content) # Revert
+            if cancelled():
+                print(f"PR #{pr_number} was superseded by a newer push. Not pushing fixes.")
+                summary["cancelled"] = True
+                return
+            started = time.perf_counter()
 
             # 5. Push Changes (Outside loop, once all files processed)
             if fixed_files:
-                self.git_ops.commit_and_push(repo, fixed_files, "chore: Security fixes by Guardian Agent", branch_name)
-                self.gitea.post_comment(repo_owner_name, repo_name, pr_number, 
-                                        f"✅ Applied fixes to: {', '.join(fixed_files)}")
+                with span("publish", files=len(fixed_files)):
+                    self.git_ops.commit_and_push(repo, fixed_files, "chore: Security fixes by Guardian Agent", branch_name)
+                    status.update(f"✅ Applied fixes to: {', '.join(fixed_files)} ({issue_count} issues found)")
+            summary["timings"]["commit_and_comment"] = time.perf_counter() - started
 
+        except AnalysisError as e:
+            print(f"Analysis failed: {e}")
+            summary["error"] = str(e)
+            status.update(f"❌ Analysis failed: {e}")
         except Exception as e:
             import traceback
+            summary["error"] = str(e)
             error_msg = f"Agent Crash: {str(e)}\n{traceback.format_exc()}"
             print(error_msg)
-            self.gitea.post_comment(repo_owner_name, repo_name, pr_number, f"❌ Agent Crashed:\n```\n{error_msg}\n```")
+            status.update(f"❌ Agent Crashed:\n```\n{error_msg}\n```")
 
-    def _validate_syntax(self, filepath):
+    def _fix_issues(self, repo_path, issues):
         """
-        Checks if the file is valid python syntax.
+        Fixes all issues of one file with a single batched LLM request.
+        Returns a FileFix for validation, or None if nothing was applied.
+        The file on disk is left untouched until validation.
         """
-        try:
-            subprocess.run(["python", "-m", "py_compile", filepath], check=True, capture_output=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False
+        filename = issues[0]['filename']
+        # Bandit returns distinct paths. usually relative to CWD if run with relative path.
+        
+        target_file = filename
+        if not os.path.exists(target_file):
+            # Fallback: try joining
+            target_file = os.path.join(repo_path, filename)
+        
+        if not os.path.exists(target_file):
+            print(f"File not found: {target_file} (Original: {filename})")
+            return None
+
+        with open(target_file, 'r') as f:
+            content = f.read()
+
+        print(f"Fixing {len(issues)} issue(s) in {filename}...")
+        
+        # Call LLM once for every issue in this file, with only the relevant slice of large files
+        context = extract_context(content, [issue['line_number'] for issue in issues])
+        fixed_code, blocks_text = self.llm.apply_batch_fix(filename, issues, content, context=context)
+        if fixed_code == content:
+            print(f"No changes applied to {filename}.")
+            return None
+
+        return FileFix(target_file, content, parse_search_replace_blocks(blocks_text), issues,
+                       context.regions if context else None)
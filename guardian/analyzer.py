@@ -1,22 +1,303 @@
 import subprocess
+import hashlib
 import json
+import linecache
+import multiprocessing
 import os
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .cache import DiskCache
+from .tracing import record, span
+
+try:
+    # Imported once per process: this loads every Bandit plugin up front
+    from bandit.core import config as b_config
+    from bandit.core import constants as b_constants
+    from bandit.core import docs_utils as b_docs
+    from bandit.core import manager as b_manager
+    from bandit import __version__ as BANDIT_VERSION
+except ImportError:
+    b_manager = None
+    BANDIT_VERSION = "unknown"
+
+class AnalysisError(Exception):
+    """Raised when the Bandit backend fails to run."""
+
+# Bump when _filter_results changes shape so cached findings are not reused
+FINDINGS_FORMAT_VERSION = 3
+
+# Same directories the Bandit CLI skips by default
+EXCLUDED_DIRS = {".svn", "CVS", ".bzr", ".hg", ".git", "__pycache__", ".tox", ".eggs"}
+
+def _scan_shard(index, paths, backend):
+    """
+    Process pool entry point: scans one shard serially and reports its timing.
+    """
+    started = time.perf_counter()
+    results = Analyzer(backend, cache=False)._scan_serial(paths)
+    return index, results, time.perf_counter() - started
 
 class Analyzer:
-    def run_bandit(self, repo_path):
+    _bandit_config = None
+    # Shared across Analyzer instances so worker processes (and their loaded
+    # Bandit plugins) are reused between runs
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, backend=None, cache=None, workers=None):
+        # "inprocess" drives Bandit's manager API directly; "subprocess" runs the CLI
+        self.backend = backend or os.getenv("GUARDIAN_BANDIT_BACKEND", "inprocess")
+        if cache is None and os.getenv("GUARDIAN_FINDING_CACHE", "1") != "0":
+            max_mb = float(os.getenv("GUARDIAN_FINDING_CACHE_MB", 64))
+            cache = DiskCache("findings", max_bytes=int(max_mb * 1024 * 1024))
+        self.cache = cache or None
+        self.workers = int(workers or os.getenv("GUARDIAN_SCAN_WORKERS", 0) or self._available_cpus())
+        self.min_shard_files = int(os.getenv("GUARDIAN_SCAN_SHARD_MIN", 25))
+        # Files per in-process chunk when streaming results without a pool
+        self.stream_chunk_files = int(os.getenv("GUARDIAN_SCAN_CHUNK", 8))
+        self.last_shard_timings = []
+
+    def run_bandit(self, repo_path, files=None, changed_lines=None):
         """
         Runs bandit on the repo_path and returns a list of issues.
+
+        files: optional list of paths relative to repo_path. When given, only
+        those files are scanned (PR-scoped mode) instead of the whole repo.
+        changed_lines: optional {relative path: set(line numbers)}. When given,
+        only findings that touch a changed line are kept.
+        """
+        try:
+            findings = [issue for _, issues in self.iter_bandit(repo_path, files, changed_lines) for issue in issues]
+        except AnalysisError as e:
+            return {"error": str(e)}
+        findings.sort(key=lambda issue: (issue["filename"], issue["line_number"]))
+        return findings
+
+    def iter_bandit(self, repo_path, files=None, changed_lines=None):
+        """
+        Same as run_bandit, but yields (filename, issues) for each file with
+        findings as soon as they are known: cached files first, then each
+        scanned chunk or shard as it completes. Raises AnalysisError if the
+        backend fails.
+        """
+        if files is not None:
+            targets = [os.path.join(repo_path, f) for f in files if f.endswith(".py")]
+            if not targets:
+                print(f"No changed Python files to scan in {repo_path}.")
+                return
+            print(f"Running Bandit on {len(targets)} changed file(s) in {repo_path}...")
+        else:
+            targets = self._discover_files(repo_path)
+            print(f"Running Bandit on {repo_path} ({len(targets)} files)...")
+
+        cached_findings = []
+        to_scan = {}
+        with span("bandit.cache", files=len(targets)) as s:
+            for path in targets:
+                key = self._cache_key(path)
+                cached = self.cache.get(key) if self.cache and key else None
+                if cached is not None:
+                    cached_findings.extend(dict(issue, filename=path) for issue in cached)
+                else:
+                    to_scan[path] = key
+            s.set(hits=len(targets) - len(to_scan))
+
+        if self.cache:
+            print(f"Finding cache: {len(targets) - len(to_scan)} hit(s), {len(to_scan)} file(s) to scan.")
+        yield from self._group_by_file(cached_findings, repo_path, changed_lines)
+
+        if not to_scan:
+            return
+        for chunk, results in self._scan(list(to_scan)):
+            scanned = self._filter_results(results)
+            # Bandit may rewrite paths (e.g. prefix "./"); map back to ours
+            by_abs = {os.path.abspath(path): path for path in chunk}
+            for issue in scanned:
+                issue["filename"] = by_abs.get(os.path.abspath(issue["filename"]), issue["filename"])
+            if self.cache:
+                self._store({path: to_scan[path] for path in chunk}, scanned)
+            yield from self._group_by_file(scanned, repo_path, changed_lines)
+
+    def _group_by_file(self, findings, repo_path, changed_lines):
+        if changed_lines is not None:
+            findings = self._filter_to_changed_lines(findings, repo_path, changed_lines)
+        by_file = {}
+        for issue in findings:
+            by_file.setdefault(issue["filename"], []).append(issue)
+        for filename in sorted(by_file):
+            yield filename, sorted(by_file[filename], key=lambda issue: issue["line_number"])
+
+    def _discover_files(self, repo_path):
+        found = []
+        for root, dirs, names in os.walk(repo_path):
+            dirs[:] = sorted(d for d in dirs if d not in EXCLUDED_DIRS and not d.endswith(".egg"))
+            found.extend(os.path.join(root, n) for n in sorted(names) if n.endswith((".py", ".pyw")))
+        return found
+
+    def _cache_key(self, path):
+        """
+        Keys findings by git blob hash of the file, Bandit version and rule
+        config, so identical files are never scanned twice.
+        """
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except OSError:
+            return None
+        blob = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+        return f"{blob}:{BANDIT_VERSION}:{FINDINGS_FORMAT_VERSION}:{self._rules_digest()}"
+
+    def _rules_digest(self):
+        config = getattr(self._get_bandit_config(), "_config", None) or {}
+        return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+    def _store(self, keys_by_path, findings):
+        by_path = {path: [] for path in keys_by_path}
+        for issue in findings:
+            if issue["filename"] in by_path:
+                by_path[issue["filename"]].append({k: v for k, v in issue.items() if k != "filename"})
+        for path, issues in by_path.items():
+            if keys_by_path[path]:
+                self.cache.put(keys_by_path[path], issues)
+
+    def _scan(self, paths):
+        """
+        Scans an explicit list of files and yields (chunk_paths, raw_results)
+        as each chunk completes. Shards across a process pool when there are
+        enough files to make it worthwhile, otherwise scans small chunks
+        in-process so callers still get results incrementally.
+        """
+        shard_count = min(self.workers, len(paths) // self.min_shard_files)
+        if shard_count > 1:
+            yield from self._scan_parallel(paths, shard_count)
+            return
+
+        self.last_shard_timings = []
+        for start in range(0, len(paths), self.stream_chunk_files):
+            chunk = paths[start:start + self.stream_chunk_files]
+            started = time.perf_counter()
+            with span("bandit.scan", files=len(chunk), bytes=sum(self._file_size(p) for p in chunk)) as s:
+                results = self._scan_serial(chunk)
+                if isinstance(results, dict):
+                    raise AnalysisError(results["error"])
+                s.set(findings=len(results))
+            self.last_shard_timings.append({"shard": len(self.last_shard_timings), "files": len(chunk),
+                                            "seconds": time.perf_counter() - started, "findings": len(results)})
+            yield chunk, results
+
+    def _scan_serial(self, paths):
+        """
+        Scans files in this process with the configured backend.
+        """
+        if self.backend == "inprocess" and b_manager is not None:
+            try:
+                return self._scan_in_process(paths)
+            except Exception as e:
+                print(f"In-process Bandit failed, falling back to subprocess: {e}")
+        return self._scan_subprocess(paths)
+
+    def _scan_parallel(self, paths, shard_count):
+        # Balance shards by file size: biggest files first onto the lightest shard
+        shards = [[] for _ in range(shard_count)]
+        loads = [0] * shard_count
+        for path in sorted(paths, key=self._file_size, reverse=True):
+            lightest = loads.index(min(loads))
+            shards[lightest].append(path)
+            loads[lightest] += self._file_size(path)
+
+        print(f"Scanning {len(paths)} files in {shard_count} shards...")
+        started = time.perf_counter()
+        pool = self._get_pool()
+        futures = [pool.submit(_scan_shard, i, sorted(shard), self.backend) for i, shard in enumerate(shards)]
+
+        timings = []
+        try:
+            for future in as_completed(futures):
+                index, results, seconds = future.result()
+                if isinstance(results, dict):
+                    raise AnalysisError(results["error"])
+                timings.append({"shard": index, "files": len(shards[index]), "seconds": seconds, "findings": len(results)})
+                record("bandit.shard", seconds, shard=index, files=len(shards[index]),
+                       bytes=sum(self._file_size(p) for p in shards[index]), findings=len(results))
+                print(f"  shard {index}: {len(shards[index])} files, {len(results)} findings in {seconds:.2f}s")
+
+                unique = {}
+                for issue in results:
+                    key = (os.path.abspath(issue["filename"]), issue["line_number"], issue.get("test_id"), issue.get("col_offset"))
+                    unique.setdefault(key, issue)
+                yield shards[index], list(unique.values())
+        finally:
+            for future in futures:
+                future.cancel()
+            self.last_shard_timings = sorted(timings, key=lambda t: t["shard"])
+
+        wall = time.perf_counter() - started
+        busy = sum(t["seconds"] for t in timings)
+        print(f"Sharded scan took {wall:.2f}s wall for {busy:.2f}s of work ({busy / wall if wall else 0:.1f}x).")
+
+    def _available_cpus(self):
+        # Respects CPU affinity / container limits where the platform exposes them
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+
+    def _file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _get_pool(self):
+        with Analyzer._pool_lock:
+            if Analyzer._pool is None:
+                # spawn, not fork: the webhook server is multi-threaded
+                Analyzer._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return Analyzer._pool
+
+    def _get_bandit_config(self):
+        if Analyzer._bandit_config is None and b_manager is not None:
+            Analyzer._bandit_config = b_config.BanditConfig()
+        return Analyzer._bandit_config
+
+    def _scan_in_process(self, targets):
+        """
+        Scans targets with Bandit's manager API and returns raw result dicts
+        in the same shape as Bandit's JSON report.
+        """
+        # Bandit reads code snippets through linecache. Drop entries for files
+        # edited since they were cached, and don't keep every scanned checkout in memory
+        linecache.checkcache()
+        try:
+            manager = b_manager.BanditManager(self._get_bandit_config(), "file", quiet=True)
+            manager.discover_files(targets, excluded_paths=",".join(b_constants.EXCLUDE))
+            manager.run_tests()
+
+            results = []
+            for issue in manager.get_issue_list():
+                result = issue.as_dict()
+                result["more_info"] = b_docs.get_url(result["test_id"])
+                results.append(result)
+            return results
+        finally:
+            linecache.clearcache()
+
+    def _scan_subprocess(self, targets):
+        """
+        Fallback: runs the Bandit CLI in a new interpreter.
         """
-        print(f"Running Bandit on {repo_path}...")
-        # Run bandit and dump to a temp json file
-        output_file = "bandit_report.json"
-        
-        # -r: recursive, -f: format, -o: output file
-        cmd = [sys.executable, "-m", "bandit", "-r", repo_path, "-f", "json", "-o", output_file]
-        
+        # Per-call report file so concurrent runs don't overwrite each other
+        fd, output_file = tempfile.mkstemp(prefix="bandit_", suffix=".json")
+        os.close(fd)
+
+        # -f: format, -o: output file
+        cmd = [sys.executable, "-m", "bandit", *targets, "-f", "json", "-o", output_file]
+
         try:
-            result = subprocess.run(cmd, check=False, capture_output=True) 
+            result = subprocess.run(cmd, check=False, capture_output=True)
             # Bandit returns 1 if issues found, so we don't check=True
             if result.returncode not in [0, 1]:
                  print(f"Bandit failed: {result.stderr}")
@@ -24,17 +305,30 @@ class Analyzer:
         except FileNotFoundError:
             return {"error": "Bandit not installed"}
 
-        if not os.path.exists(output_file):
+        try:
+            with open(output_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
             return []
+        finally:
+            # Cleanup
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+        return data.get("results", [])
 
-        with open(output_file, "r") as f:
-            data = json.load(f)
-        
-        # Cleanup
-        os.remove(output_file)
-        
-        results = data.get("results", [])
-        return self._filter_results(results)
+    def _filter_to_changed_lines(self, results, repo_path, changed_lines):
+        """
+        Keeps only findings whose line range overlaps a changed hunk.
+        """
+        kept = []
+        for issue in results:
+            rel_path = os.path.relpath(issue["filename"], repo_path).replace(os.sep, "/")
+            lines = changed_lines.get(rel_path, set())
+            issue_lines = issue.get("line_range") or [issue["line_number"]]
+            if any(line in lines for line in issue_lines):
+                kept.append(issue)
+        return kept
 
     def _filter_results(self, results):
         """
@@ -46,6 +340,9 @@ class Analyzer:
                 filtered.append({
                     "filename": issue["filename"],
                     "line_number": issue["line_number"],
+                    "line_range": issue.get("line_range") or [issue["line_number"]],
+                    "test_id": issue.get("test_id"),
+                    "severity": issue.get("issue_severity"),
                     "issue_text": issue["issue_text"],
                     "code": issue["code"],
                     "more_info": issue["more_info"],
@@ -0,0 +1,120 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from .metrics import CACHE_LOOKUPS
+
+
+class DiskCache:
+    """
+    Small persistent key/value store on top of SQLite.
+
+    Values must be JSON-serialisable. Entries are evicted least-recently-used
+    first once the table grows past max_bytes, and expire after ttl seconds
+    when a ttl is set. Hit/miss counters are kept per instance.
+
+    The table size is summed once when the cache is opened and then kept
+    as a running total, so a put costs the same however many entries
+    there are.
+    """
+
+    def __init__(self, name, db_path=None, max_bytes=None, ttl=None):
+        if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+            raise ValueError(f"Invalid cache name: {name}")
+        self.name = name
+        self.db_path = db_path or os.getenv("GUARDIAN_CACHE_DB", os.path.join(".guardian", "cache.db"))
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.name} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_last_used ON {self.name} (last_used)")
+        self._bytes = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.name}").fetchone()[0]
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created_at, size FROM {self.name} WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                self._bytes -= row[2]
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+                return default
+            self._conn.execute(f"UPDATE {self.name} SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(f"SELECT size FROM {self.name} WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.name} (key, value, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._bytes += len(data) - (old[0] if old else 0)
+            if self.max_bytes is not None:
+                self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            old = self._conn.execute(f"SELECT size FROM {self.name} WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                self._bytes -= old[0]
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute(f"SELECT key, size FROM {self.name} ORDER BY last_used"):
+            if self._bytes <= self.max_bytes:
+                break
+            stale.append((key,))
+            self._bytes -= size
+        self._conn.executemany(f"DELETE FROM {self.name} WHERE key = ?", stale)
+        self.evictions += len(stale)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.name}"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
@@ -0,0 +1,90 @@
+import ast
+
+
+class ContextSlice:
+    """
+    The parts of a file worth showing the LLM for a set of findings.
+
+    regions are 1-based, inclusive (start, end) line ranges of the full
+    file; text is those lines joined with markers where lines were left out.
+    """
+
+    def __init__(self, text, regions):
+        self.text = text
+        self.regions = regions
+
+    def __repr__(self):
+        return f"ContextSlice(regions={self.regions})"
+
+
+def extract_context(source, line_numbers, margin=3, max_full_lines=200, max_node_lines=150):
+    """
+    Slices source down to the module imports plus the innermost function or
+    class enclosing each finding and a few lines around it. Returns None when
+    the file is small enough to send whole.
+    """
+    lines = source.splitlines(keepends=True)
+    if len(lines) <= max_full_lines:
+        return None
+
+    regions = []
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        tree = None
+
+    if tree is not None:
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                regions.append((node.lineno, node.end_lineno))
+
+    for line in line_numbers:
+        if not line:
+            continue
+        regions.append((line - margin, line + margin))
+        node = _enclosing_node(tree, line) if tree is not None else None
+        if node is not None and node.end_lineno - node.lineno < max_node_lines:
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            regions.append((start, node.end_lineno))
+
+    regions = _merge(regions, len(lines))
+    return ContextSlice(_render(lines, regions), regions)
+
+
+def _enclosing_node(tree, line):
+    """
+    Innermost def/class whose span contains line.
+    """
+    best = None
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if node.lineno <= line <= node.end_lineno:
+                if best is None or node.end_lineno - node.lineno < best.end_lineno - best.lineno:
+                    best = node
+    return best
+
+
+def _merge(regions, total_lines):
+    clipped = sorted((max(1, s), min(total_lines, e)) for s, e in regions if s <= total_lines and e >= 1)
+    merged = []
+    for start, end in clipped:
+        # Adjacent or overlapping ranges become one, so no gap marker sits between them
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _render(lines, regions):
+    parts = []
+    previous_end = 0
+    for start, end in regions:
+        if start > previous_end + 1:
+            parts.append(f"# ... lines {previous_end + 1}-{start - 1} omitted ...\n")
+        chunk = "".join(lines[start - 1:end])
+        parts.append(chunk if chunk.endswith("\n") else chunk + "\n")
+        previous_end = end
+    if previous_end < len(lines):
+        parts.append(f"# ... lines {previous_end + 1}-{len(lines)} omitted ...\n")
+    return "".join(parts)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+from .cache import DiskCache
+from .patch_engine import apply_blocks
+
+# Bump when the shape of cached fixes changes, so older entries are not replayed
+FIX_FORMAT_VERSION = 2
+
+
+def _normalize(line):
+    return " ".join(line.split())
+
+
+class FixCache:
+    """
+    Remembers validated SEARCH/REPLACE blocks per vulnerability signature,
+    so a pattern we have already fixed once is replayed without an LLM call.
+
+    The signature is (Bandit test id, normalized offending line, hash of the
+    normalized surrounding lines). Each signature maps to every block of the
+    validated fix, since a fix often needs edits away from the offending
+    line (an import, the call that runs a parameterized query). A cached
+    fix is only replayed if every one of its blocks still applies.
+    """
+
+    def __init__(self, cache=None, ttl=None, max_bytes=None, context_lines=2):
+        if cache is None:
+            ttl = ttl or float(os.getenv("GUARDIAN_FIX_CACHE_TTL", 7 * 24 * 3600))
+            max_bytes = max_bytes or int(float(os.getenv("GUARDIAN_FIX_CACHE_MB", 16)) * 1024 * 1024)
+            cache = DiskCache("fixes", max_bytes=max_bytes, ttl=ttl)
+        self.cache = cache
+        self.context_lines = context_lines
+        self.replayed = 0
+        self.stale = 0
+
+    def signature(self, issue, content):
+        test_id = issue.get("test_id")
+        line_number = issue.get("line_number")
+        lines = content.splitlines()
+        if not test_id or not line_number or not 0 < line_number <= len(lines):
+            return None
+
+        snippet = _normalize(lines[line_number - 1])
+        start = max(0, line_number - 1 - self.context_lines)
+        context = "\n".join(_normalize(l) for l in lines[start:line_number + self.context_lines])
+        context_hash = hashlib.sha256(context.encode()).hexdigest()
+        return hashlib.sha256(f"{FIX_FORMAT_VERSION}\0{test_id}\0{snippet}\0{context_hash}".encode()).hexdigest()
+
+    def lookup(self, issue, content):
+        """
+        Returns cached [(search, replace), ...] for the issue if all of them
+        still apply cleanly to content, otherwise None.
+        """
+        key = self.signature(issue, content)
+        if key is None:
+            return None
+        blocks = self.cache.get(key)
+        if blocks is None:
+            return None
+        blocks = [tuple(block) for block in blocks]
+        if not self._applies(content, blocks):
+            self.stale += 1
+            return None
+        self.replayed += 1
+        return blocks
+
+    def store(self, issue, content, blocks):
+        """
+        Caches blocks, the whole validated fix of content, under the issue's
+        signature. Nothing is cached unless every block applies to content.
+        """
+        key = self.signature(issue, content)
+        if key is None or not blocks:
+            return
+        blocks = [tuple(block) for block in blocks]
+        if self._applies(content, blocks):
+            self.cache.put(key, [list(block) for block in blocks])
+
+    @staticmethod
+    def _applies(content, blocks):
+        # Applied in order, as the fix was: a block may match text an earlier one produced
+        return not apply_blocks(content, blocks).failed
+
+    def stats(self):
+        stats = self.cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "replayed": self.replayed,
+            "stale": self.stale,
+            "replay_rate": self.replayed / lookups if lookups else 0.0,
+        })
+        return stats
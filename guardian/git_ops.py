@@ -1,39 +1,153 @@
 import git
+import hashlib
 import os
+import re
 import shutil
+import threading
+from .metrics import PUSH_FAILURES
+from .tracing import span
 
 class GitOps:
-    def __init__(self, work_dir="./temp_repos"):
+    # One lock per mirror so concurrent runs don't fetch into it at the same time
+    _mirror_locks = {}
+    _mirror_locks_guard = threading.Lock()
+
+    def __init__(self, work_dir="./temp_repos", use_mirror=None):
         self.work_dir = work_dir
+        self.mirror_dir = os.path.join(self.work_dir, "_mirrors")
+        if use_mirror is None:
+            use_mirror = os.getenv("GUARDIAN_GIT_MIRROR", "1") != "0"
+        self.use_mirror = use_mirror
         if not os.path.exists(self.work_dir):
             os.makedirs(self.work_dir)
 
+    def _mirror_path(self, repo_url):
+        name = re.sub(r"\.git$", "", repo_url.rstrip("/").split("/")[-1]) or "repo"
+        digest = hashlib.sha1(repo_url.encode()).hexdigest()[:10]
+        return os.path.join(self.mirror_dir, f"{name}_{digest}.git")
+
+    def _mirror_lock(self, mirror_path):
+        with self._mirror_locks_guard:
+            return self._mirror_locks.setdefault(mirror_path, threading.Lock())
+
+    def refresh_mirror(self, repo_url):
+        """
+        Keeps one bare mirror per remote. The first call clones it, later
+        calls only fetch what changed. Returns the mirror path.
+        """
+        mirror_path = self._mirror_path(repo_url)
+        with span("git.mirror") as s, self._mirror_lock(mirror_path):
+            if os.path.exists(mirror_path):
+                s.set(action="fetch")
+                print(f"Fetching {repo_url} into mirror {mirror_path}...")
+                git.Repo(mirror_path).git.fetch("--prune", "origin")
+            else:
+                s.set(action="clone")
+                print(f"Creating mirror of {repo_url} at {mirror_path}...")
+                mirror = git.Repo.clone_from(repo_url, mirror_path, mirror=True)
+                # Checkouts borrow objects from the mirror, so gc must never prune them
+                mirror.git.config("gc.pruneExpire", "never")
+        return mirror_path
+
     def clone_repo(self, repo_url, repo_dir):
+        with span("git.clone", mirror=self.use_mirror):
+            return self._clone_repo(repo_url, repo_dir)
+
+    def _clone_repo(self, repo_url, repo_dir):
         repo_path = os.path.join(self.work_dir, repo_dir)
         if os.path.exists(repo_path):
-            # Windows workaround for read-only git files
-            def on_rm_error(func, path, exc_info):
-                import stat
-                try:
-                    os.chmod(path, stat.S_IWRITE)
-                    func(path)
-                except Exception as e:
-                    print(f"Failed to remove {path}: {e}")
-            
-            shutil.rmtree(repo_path, onerror=on_rm_error)
-        
-        print(f"Cloning {repo_url} to {repo_path}...")
-        repo = git.Repo.clone_from(repo_url, repo_path)
+            self.cleanup(repo_path)
+
+        if not self.use_mirror:
+            print(f"Cloning {repo_url} to {repo_path}...")
+            repo = git.Repo.clone_from(repo_url, repo_path)
+            return repo, repo_path
+
+        mirror_path = self.refresh_mirror(repo_url)
+        print(f"Creating shared checkout of {repo_url} at {repo_path}...")
+        # --shared reuses the mirror's object store instead of copying it
+        repo = git.Repo.clone_from(mirror_path, repo_path, shared=True)
+        # Push fixes to the real remote, not the mirror
+        repo.remotes.origin.set_url(repo_url)
         return repo, repo_path
 
+    def cleanup(self, repo_path):
+        """Removes a per-run checkout. The shared mirror is kept."""
+        # Windows workaround for read-only git files
+        def on_rm_error(func, path, exc_info):
+            import stat
+            try:
+                os.chmod(path, stat.S_IWRITE)
+                func(path)
+            except Exception as e:
+                print(f"Failed to remove {path}: {e}")
+
+        shutil.rmtree(repo_path, onerror=on_rm_error)
+
     def checkout_branch(self, repo, branch_name):
         print(f"Checking out {branch_name}...")
-        repo.git.checkout(branch_name)
+        with span("git.checkout"):
+            repo.git.checkout(branch_name)
+
+    def changed_files(self, repo, base_ref, head_ref="HEAD"):
+        """
+        Returns {path: set(changed line numbers)} for files added or modified
+        on head_ref since it diverged from base_ref. Paths are relative to
+        the repo root; line numbers refer to the head version of the file.
+        """
+        if not base_ref.startswith("origin/") and f"origin/{base_ref}" in [r.name for r in repo.remotes.origin.refs]:
+            base_ref = f"origin/{base_ref}"
+        with span("git.diff", base=base_ref) as s:
+            diff = repo.git.diff(f"{base_ref}...{head_ref}", "--unified=0", "--no-color", "--diff-filter=AMR")
+            s.set(bytes=len(diff))
+
+        changed = {}
+        current = None
+        for line in diff.splitlines():
+            if line.startswith("+++ "):
+                path = line[4:]
+                current = path[2:] if path.startswith("b/") else None
+                if current is not None:
+                    changed.setdefault(current, set())
+            elif line.startswith("@@") and current is not None:
+                # @@ -old_start,old_count +new_start,new_count @@
+                match = re.match(r"@@ -\S+ \+(\d+)(?:,(\d+))? @@", line)
+                if match:
+                    start = int(match.group(1))
+                    count = int(match.group(2)) if match.group(2) is not None else 1
+                    changed[current].update(range(start, start + count))
+        return changed
+
+    def pr_scope(self, repo, base_branch):
+        """
+        Returns (files, changed_lines) limiting analysis to what the PR
+        changed, or (None, None) to scan the whole repository when there is
+        no base branch or it cannot be diffed. GUARDIAN_HUNK_FILTER=0 keeps
+        findings anywhere in the changed files, not only on changed lines.
+        """
+        if not base_branch:
+            return None, None
+        try:
+            changed = self.changed_files(repo, base_branch)
+        except git.GitCommandError as e:
+            print(f"Could not diff against {base_branch}, scanning whole repo: {e}")
+            return None, None
+        hunks_only = os.getenv("GUARDIAN_HUNK_FILTER", "1") != "0"
+        return sorted(changed), (changed if hunks_only else None)
 
     def commit_and_push(self, repo, files_to_add, commit_message, branch_name):
         print(f"Committing changes: {files_to_add}")
-        repo.index.add(files_to_add)
-        repo.index.commit(commit_message)
+        with span("git.commit", files=len(files_to_add)):
+            repo.index.add(files_to_add)
+            repo.index.commit(commit_message)
+        if os.getenv("GUARDIAN_DRY_RUN", "0") == "1":
+            print(f"Dry run: not pushing to origin/{branch_name}.")
+            return
         print(f"Pushing to origin/{branch_name}...")
-        origin = repo.remote(name='origin')
-        origin.push(branch_name)
+        with span("git.push", branch=branch_name):
+            origin = repo.remote(name='origin')
+            try:
+                origin.push(branch_name)
+            except Exception:
+                PUSH_FAILURES.inc()
+                raise
@@ -1,28 +1,277 @@
+import asyncio
 import requests
 import os
+import threading
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .tracing import span
+
+# Rate limiting and transient server errors; anything else is returned to the caller
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses on which a POST is known not to have been processed. After a 500,
+# 502 or 504 the comment may already exist, so re-sending could post it twice
+POST_RETRY_STATUSES = (429, 503)
+
+# Hidden marker that identifies Guardian's status comment on a PR
+STATUS_MARKER = "<!-- guardian-status -->"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class _Retry(Retry):
+    """Retry that only re-sends a POST on POST_RETRY_STATUSES."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == "POST" and status_code not in POST_RETRY_STATUSES:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def get_session():
+    """
+    Keep-alive session shared by every GiteaClient, so comments from all
+    workers reuse one connection pool instead of opening a connection each.
+
+    GUARDIAN_GITEA_POOL sets the pool size, GUARDIAN_GITEA_RETRIES and
+    GUARDIAN_GITEA_BACKOFF the retries on connection errors and on the
+    statuses in RETRY_STATUSES (honouring Retry-After), POSTs only on
+    POST_RETRY_STATUSES. Requests that reached the server and then timed
+    out are not retried, so a slow Gitea or a failing proxy cannot make us
+    post the same comment twice.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = int(os.getenv("GUARDIAN_GITEA_RETRIES", 3))
+            retry = _Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                status=retries,
+                backoff_factor=float(os.getenv("GUARDIAN_GITEA_BACKOFF", 0.5)),
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=None,  # PATCH too; POST is narrowed by _Retry
+                raise_on_status=False,
+            )
+            pool_size = int(os.getenv("GUARDIAN_GITEA_POOL", 10))
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+class StatusComment:
+    """
+    The Guardian status comment of one PR run. update() appends a line;
+    lines arriving within debounce seconds are batched into one edit of
+    the PR's single status comment. close() writes what is pending, so a
+    run costs at most one write per debounce window plus the final one.
+    """
+
+    def __init__(self, client, repo_owner, repo_name, pr_index, debounce=None):
+        self.client = client
+        self.repo_owner = repo_owner
+        self.repo_name = repo_name
+        self.pr_index = pr_index
+        self.debounce = float(debounce if debounce is not None else os.getenv("GUARDIAN_STATUS_DEBOUNCE", 2))
+        self.lines = []
+        self.writes = 0
+        self._dirty = False
+        self._timer = None
+        self._lock = threading.Lock()
+        # Keeps writes in order when a timer flush overlaps close()
+        self._write_lock = threading.Lock()
+
+    def update(self, text):
+        with self._lock:
+            self.lines.append(text)
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.debounce, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def render(self):
+        return "\n\n".join([STATUS_MARKER, "🛡️ **Guardian Agent** status for the latest push:"] + self.lines)
+
+    def flush(self, create=True):
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                body = self.render()
+            self.writes += 1
+            self.client.upsert_status_comment(self.repo_owner, self.repo_name, self.pr_index, body, create=create)
+
+    def close(self, final=None):
+        """
+        Writes what is pending. final is appended as the run's last line;
+        when the run had nothing else to report it only replaces an earlier
+        status, so quiet PRs never get a comment.
+        """
+        with self._lock:
+            replace_only = final is not None and not self.lines
+            if final is not None:
+                self.lines.append(final)
+                self._dirty = True
+        self.flush(create=not replace_only)
+
 
 class GiteaClient:
-    def __init__(self, base_url=None, token=None, username=None, password=None):
+    def __init__(self, base_url=None, token=None, username=None, password=None, session=None, timeout=None):
         self.base_url = base_url or os.getenv("GITEA_URL", "http://localhost:3000")
         self.token = token or os.getenv("GITEA_TOKEN")
         self.username = username or os.getenv("GITEA_USER")
         self.password = password or os.getenv("GITEA_PASS")
-        
+        self.session = session or get_session()
+        # (connect, read) seconds, so a stalled Gitea can't hang a worker
+        self.timeout = timeout or (float(os.getenv("GUARDIAN_GITEA_CONNECT_TIMEOUT", 5)),
+                                   float(os.getenv("GUARDIAN_GITEA_TIMEOUT", 30)))
+
         self.headers = {"Content-Type": "application/json"}
         self.auth = None
-        
+
         if self.token:
             self.headers["Authorization"] = f"token {self.token}"
         elif self.username and self.password:
             self.auth = (self.username, self.password)
 
+        # (owner, repo, pr) -> status comment id, so it is looked up once per PR
+        self._status_ids = OrderedDict()
+        self._status_ids_max = 1024
+        self._statuses = {}
+        self._status_lock = threading.Lock()
+        self._login = None
+
+    def _request(self, method, url, payload, expected_status):
+        """
+        Sends one API request. Returns (status code, JSON body). Failures
+        are logged and give (status or None, {}) instead of raising.
+        """
+        try:
+            resp = self.session.request(method, url, json=payload, headers=self.headers, auth=self.auth,
+                                        timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"Gitea request {method} {url} failed: {e}")
+            return None, {}
+        try:
+            data = resp.json() if resp.content else {}
+        except ValueError:
+            data = {}
+        if resp.status_code != expected_status:
+            print(f"Gitea request {method} {url} returned {resp.status_code}: {resp.text[:500]}")
+            return resp.status_code, {}
+        return resp.status_code, data
+
     def post_comment(self, repo_owner, repo_name, pr_index, body):
         url = f"{self.base_url}/api/v1/repos/{repo_owner}/{repo_name}/issues/{pr_index}/comments"
+        if os.getenv("GUARDIAN_DRY_RUN", "0") == "1":
+            print(f"Dry run: not posting comment to {url}:\n{body}")
+            return {}
         print(f"Posting comment to {url}")
-        resp = requests.post(url, json={"body": body}, headers=self.headers, auth=self.auth)
-        if resp.status_code != 201:
-            print(f"Failed to post comment: {resp.text}")
-        return resp.json()
+        with span("gitea.comment", bytes=len(body.encode())) as s:
+            status, data = self._request("POST", url, {"body": body}, 201)
+            s.set(status=status)
+        return data
+
+    def edit_comment(self, repo_owner, repo_name, comment_id, body):
+        url = f"{self.base_url}/api/v1/repos/{repo_owner}/{repo_name}/issues/comments/{comment_id}"
+        with span("gitea.edit_comment", bytes=len(body.encode())) as s:
+            status, data = self._request("PATCH", url, {"body": body}, 200)
+            s.set(status=status)
+        return status, data
+
+    def bot_login(self):
+        """Login of the account Guardian posts as, or None if it can't be determined."""
+        if self._login is None:
+            _, user = self._request("GET", f"{self.base_url}/api/v1/user", None, 200)
+            self._login = user.get("login") or self.username
+        return self._login
+
+    def find_status_comment(self, repo_owner, repo_name, pr_index):
+        """
+        Returns the id of Guardian's own PR comment carrying STATUS_MARKER,
+        or None. Comments by anyone else are ignored even if they quote the
+        marker, so Guardian never edits a user's comment.
+        """
+        login = self.bot_login()
+        if not login:
+            return None
+        url = f"{self.base_url}/api/v1/repos/{repo_owner}/{repo_name}/issues/{pr_index}/comments"
+        _, comments = self._request("GET", url, None, 200)
+        for comment in comments or []:
+            author = (comment.get("user") or {}).get("login")
+            if author == login and STATUS_MARKER in (comment.get("body") or ""):
+                return comment.get("id")
+        return None
+
+    def upsert_status_comment(self, repo_owner, repo_name, pr_index, body, create=True):
+        """
+        Edits the PR's status comment in place, creating it on first use.
+        Recreates it if it was deleted in the meantime. With create=False
+        only an existing status comment is updated.
+        """
+        key = (repo_owner, repo_name, pr_index)
+        if os.getenv("GUARDIAN_DRY_RUN", "0") == "1":
+            print(f"Dry run: not updating status comment on {repo_owner}/{repo_name}#{pr_index}:\n{body}")
+            return {}
+        with self._status_lock:
+            comment_id = self._status_ids.get(key)
+        if comment_id is None:
+            comment_id = self.find_status_comment(repo_owner, repo_name, pr_index)
+        if comment_id is not None:
+            print(f"Updating status comment {comment_id} on {repo_owner}/{repo_name}#{pr_index}")
+            status, data = self.edit_comment(repo_owner, repo_name, comment_id, body)
+            if status == 200:
+                self._remember_status(key, comment_id)
+                return data
+            # Look the comment up again next time; only a deleted one is recreated now
+            self._remember_status(key, None)
+            if status != 404:
+                return {}
+        if not create:
+            self._remember_status(key, None)
+            return {}
+        data = self.post_comment(repo_owner, repo_name, pr_index, body)
+        self._remember_status(key, data.get("id"))
+        return data
+
+    def _remember_status(self, key, comment_id):
+        with self._status_lock:
+            if comment_id is None:
+                self._status_ids.pop(key, None)
+                return
+            self._status_ids[key] = comment_id
+            self._status_ids.move_to_end(key)
+            while len(self._status_ids) > self._status_ids_max:
+                self._status_ids.popitem(last=False)
+
+    def status_comment(self, repo_owner, repo_name, pr_index, new_run=False):
+        """
+        The StatusComment of the PR's current run. new_run=True starts an
+        empty one, replacing what the previous run wrote.
+        """
+        key = (repo_owner, repo_name, pr_index)
+        with self._status_lock:
+            status = self._statuses.get(key)
+            if status is None or new_run:
+                status = self._statuses[key] = StatusComment(self, repo_owner, repo_name, pr_index)
+            return status
+
+    def close_status(self, repo_owner, repo_name, pr_index, final=None):
+        """Writes the pending status of a finished run, ending it with final if given."""
+        with self._status_lock:
+            status = self._statuses.pop((repo_owner, repo_name, pr_index), None)
+        if status is not None:
+            status.close(final)
 
     def create_pr(self, repo_owner, repo_name, head, base, title, body):
         url = f"{self.base_url}/api/v1/repos/{repo_owner}/{repo_name}/pulls"
@@ -32,5 +281,12 @@ class GiteaClient:
             "title": title,
             "body": body
         }
-        resp = requests.post(url, json=data, headers=self.headers, auth=self.auth)
-        return resp.json()
+        _, created = self._request("POST", url, data, 201)
+        return created
+
+    async def post_comment_async(self, repo_owner, repo_name, pr_index, body):
+        """Non-blocking post_comment for use from an event loop."""
+        return await asyncio.to_thread(self.post_comment, repo_owner, repo_name, pr_index, body)
+
+    async def create_pr_async(self, repo_owner, repo_name, head, base, title, body):
+        return await asyncio.to_thread(self.create_pr, repo_owner, repo_name, head, base, title, body)
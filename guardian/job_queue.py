@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another pending job."""
+
+
+class JobQueue:
+    """
+    Durable FIFO of webhook jobs backed by a local SQLite file.
+
+    Jobs that were running when the process died are put back in the
+    queue by recover(), so nothing is lost across a server restart.
+    Constructing a queue has no such side effect: spawned helper
+    processes re-import the server module and must not touch jobs that
+    are still running.
+
+    Jobs sharing a key (one key per PR) are coalesced: a newer event
+    replaces the queued one instead of adding another run, and at most
+    one job per key runs at a time.
+
+    Failed jobs are kept for failed_retention seconds (default a week)
+    for inspection, then pruned.
+    """
+
+    def __init__(self, db_path=None, max_pending=None, failed_retention=None):
+        self.db_path = db_path or os.getenv("GUARDIAN_QUEUE_DB", os.path.join(".guardian", "jobs.db"))
+        self.max_pending = int(max_pending or os.getenv("GUARDIAN_QUEUE_MAX", 50))
+        self.failed_retention = float(failed_retention if failed_retention is not None
+                                      else os.getenv("GUARDIAN_QUEUE_FAILED_RETENTION", 7 * 24 * 3600))
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self._cond = threading.Condition()
+        self._latest_heads = {}
+        self._recovered = False
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                error TEXT,
+                pr_key TEXT,
+                head_sha TEXT,
+                run_after REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._migrate()
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, ddl in [("pr_key", "TEXT"), ("head_sha", "TEXT"), ("run_after", "REAL NOT NULL DEFAULT 0")]:
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {ddl}")
+
+    def recover(self):
+        """
+        Re-queues jobs left running by a previous server process. Call once,
+        from the process that runs the workers, before they start; later
+        calls do nothing.
+        """
+        with self._cond:
+            if self._recovered:
+                return
+            self._recovered = True
+            cur = self._conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            if cur.rowcount:
+                print(f" [Queue] Re-queued {cur.rowcount} job(s) interrupted by a restart.")
+            rows = self._conn.execute(
+                "SELECT pr_key, head_sha FROM jobs WHERE pr_key IS NOT NULL AND status = 'queued'"
+            ).fetchall()
+            for pr_key, head_sha in rows:
+                self._latest_heads[pr_key] = head_sha
+            self._prune_failed(time.time())
+
+    def put(self, payload, key=None, head_sha=None, delay=0):
+        """
+        Adds a job and returns its id. Raises QueueFullError when the
+        number of pending jobs has reached max_pending.
+
+        If a job with the same key is still queued, its payload is
+        replaced and its start is pushed back by delay seconds (debounce);
+        the existing job id is returned.
+        """
+        with self._cond:
+            run_after = time.time() + delay
+            if key is not None:
+                self._latest_heads[key] = head_sha
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE pr_key = ? AND status = 'queued'", (key,)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET payload = ?, head_sha = ?, run_after = ? WHERE id = ?",
+                        (json.dumps(payload), head_sha, run_after, row[0]),
+                    )
+                    self._cond.notify()
+                    return row[0]
+
+            pending = self._count("queued")
+            if pending >= self.max_pending:
+                raise QueueFullError(f"{pending} jobs already pending")
+
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, payload, status, created_at, pr_key, head_sha, run_after) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), time.time(), key, head_sha, run_after),
+            )
+            self._cond.notify()
+            return job_id
+
+    def is_superseded(self, key, head_sha):
+        """True if a newer head than head_sha has been queued for key."""
+        if key is None:
+            return False
+        with self._cond:
+            return self._latest_heads.get(key, head_sha) != head_sha
+
+    def get(self, timeout=None):
+        """
+        Claims the oldest ready job and returns (job_id, key, head_sha, payload),
+        or None if nothing became ready within timeout seconds. Jobs whose
+        debounce delay has not elapsed, or whose key already has a running
+        job, are skipped.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.time()
+                row = self._conn.execute(
+                    """
+                    SELECT id, pr_key, head_sha, payload FROM jobs
+                    WHERE status = 'queued' AND run_after <= ?
+                      AND (pr_key IS NULL OR pr_key NOT IN (
+                          SELECT pr_key FROM jobs WHERE status = 'running' AND pr_key IS NOT NULL))
+                    ORDER BY created_at LIMIT 1
+                    """,
+                    (now,),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                        (now, row[0]),
+                    )
+                    return row[0], row[1], row[2], json.loads(row[3])
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+
+                # Wake up in time for the next debounced job to become ready
+                next_ready = self._conn.execute(
+                    "SELECT MIN(run_after) FROM jobs WHERE status = 'queued' AND run_after > ?", (now,)
+                ).fetchone()[0]
+                if next_ready is not None:
+                    wait_for = next_ready - now
+                    remaining = wait_for if remaining is None else min(remaining, wait_for)
+                self._cond.wait(remaining)
+
+    def complete(self, job_id, error=None):
+        """
+        Marks a claimed job as finished. Successful jobs are removed,
+        failed ones are kept with their error for inspection until they
+        are older than failed_retention.
+        """
+        with self._cond:
+            now = time.time()
+            row = self._conn.execute("SELECT pr_key FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if error is None:
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                    (now, str(error), job_id),
+                )
+            self._prune_failed(now)
+            key = row[0] if row else None
+            if key is not None and not self._conn.execute(
+                    "SELECT 1 FROM jobs WHERE pr_key = ? AND status IN ('queued', 'running') LIMIT 1", (key,)
+            ).fetchone():
+                # Nothing left to supersede for this PR
+                self._latest_heads.pop(key, None)
+            # A queued job for the same PR may now be allowed to run
+            self._cond.notify_all()
+
+    def _prune_failed(self, now):
+        self._conn.execute("DELETE FROM jobs WHERE status = 'failed' AND finished_at < ?",
+                           (now - self.failed_retention,))
+
+    def _count(self, status):
+        return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def depth(self):
+        """Returns the number of jobs per status."""
+        with self._cond:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {"queued": 0, "running": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of threads that drain a JobQueue with a handler.
+
+    The handler is called as handler(payload, should_cancel), where
+    should_cancel() turns True once a newer head for the same PR has
+    been queued, so long runs on stale commits can stop early.
+    """
+
+    def __init__(self, queue, handler, size=None):
+        self.queue = queue
+        self.handler = handler
+        self.size = int(size or os.getenv("GUARDIAN_WORKERS", 2))
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self.queue.recover()
+            self._stopping.clear()
+            for i in range(self.size):
+                thread = threading.Thread(target=self._work, name=f"guardian-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        print(f" [Queue] Started {self.size} worker(s).")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.queue.get(timeout=1.0)
+            if job is None:
+                continue
+
+            job_id, key, head_sha, payload = job
+            with self._lock:
+                self.in_flight += 1
+            try:
+                if self.queue.is_superseded(key, head_sha):
+                    print(f" [Queue] Skipping job {job_id}: head {head_sha} of {key} was superseded.")
+                else:
+                    self.handler(payload, lambda: self.queue.is_superseded(key, head_sha))
+                self.queue.complete(job_id)
+            except Exception as e:
+                print(f" [Queue] Job {job_id} failed: {e}")
+                sys.stdout.flush()
+                self.queue.complete(job_id, error=e)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
@@ -0,0 +1,130 @@
+import json
+import os
+import google.generativeai as genai
+import requests
+
+
+class TextResponse:
+    """
+    Minimal stand-in for a Gemini response: LLMClient only reads .text.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+
+class HTTPModel:
+    """
+    Model served over a small JSON API (see ops/llm_standin.py). Exposes the
+    subset of genai.GenerativeModel that LLMClient uses, so the rest of the
+    client does not care which backend it is talking to.
+
+        POST /v1/generate {"model", "prompt", "stream"}
+          -> {"text": ...}, or one {"text": chunk} JSON object per line when streaming
+    """
+
+    def __init__(self, base_url, model_name, session=None):
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model_name
+        self.session = session or requests.Session()
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        timeout = (request_options or {}).get("timeout", 60)
+        if stream:
+            return self._stream(prompt, timeout)
+        response = self.session.post(
+            f"{self.base_url}/v1/generate",
+            json={"model": self.model_name, "prompt": prompt, "stream": False},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return TextResponse(response.json()["text"])
+
+    def _stream(self, prompt, timeout):
+        with self.session.post(
+            f"{self.base_url}/v1/generate",
+            json={"model": self.model_name, "prompt": prompt, "stream": True},
+            timeout=timeout,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield TextResponse(json.loads(line)["text"])
+
+
+class LLMBackend:
+    """
+    Where LLMClient gets its models from. Subclasses create model objects
+    with generate_content(prompt, stream=False, request_options=None).
+    """
+
+    name = None
+    # Whether LLMClient should list models and fall back to an available one
+    discovers_models = False
+
+    def is_configured(self):
+        return True
+
+    def setup(self):
+        pass
+
+    def list_models(self):
+        return []
+
+    def create_model(self, model_name):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+    discovers_models = True
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+
+    def is_configured(self):
+        return bool(self.api_key)
+
+    def setup(self):
+        genai.configure(api_key=self.api_key)
+
+    def list_models(self):
+        return [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+    def create_model(self, model_name):
+        return genai.GenerativeModel(model_name)
+
+
+class HTTPBackend(LLMBackend):
+    """
+    Any server speaking the HTTPModel protocol, e.g. the local stand-in used
+    for offline benchmarks. Configured with GUARDIAN_LLM_URL.
+    """
+
+    name = "http"
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url or os.getenv("GUARDIAN_LLM_URL", "http://localhost:8090")
+        self.session = requests.Session()
+
+    def create_model(self, model_name):
+        return HTTPModel(self.base_url, model_name, self.session)
+
+
+BACKENDS = {
+    GeminiBackend.name: GeminiBackend,
+    HTTPBackend.name: HTTPBackend,
+}
+
+
+def get_backend(name=None, api_key=None):
+    """
+    Builds the backend named by GUARDIAN_LLM_BACKEND (default "gemini").
+    """
+    name = (name or os.getenv("GUARDIAN_LLM_BACKEND", "gemini")).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}'. Choose one of: {', '.join(sorted(BACKENDS))}")
+    if name == GeminiBackend.name:
+        return GeminiBackend(api_key)
+    return BACKENDS[name]()
@@ -1,53 +1,533 @@
+import hashlib
+import itertools
+import json
 import os
-import google.generativeai as genai
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
+from .fix_cache import FixCache
+from .llm_backends import get_backend
+from .patch_engine import PatchEngine, apply_blocks
+from .metrics import LLM_CALLS, LLM_ERRORS, LLM_TOKENS
+from .rate_limit import get_rate_limiter
+from .tracing import bind, record, span
 
 load_dotenv()
 
+class LatencyTracker:
+    """
+    Rolling window of call latencies, used to pick the hedging threshold.
+    """
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
 class LLMClient:
-    def __init__(self, api_key=None, model_name="gemini-2.5-flash"):
+    # Model discovery results shared by every client in the process
+    _discovered = {}
+    _discover_lock = threading.Lock()
+    # Latency history per model name, shared so hedging thresholds learn across clients
+    _latencies = {}
+    _latency_lock = threading.Lock()
+    # Model calls in flight across every caller in the process (SecurityAgent's
+    # fixer pool, ADK tool threads). A hedge only goes out when a slot is free
+    _concurrency = int(os.getenv("GUARDIAN_LLM_CONCURRENCY", 4))
+    _slots = threading.BoundedSemaphore(_concurrency)
+    # Runs blocking model calls so a slow primary can be hedged; losers may still be finishing
+    _executor = ThreadPoolExecutor(max_workers=max(16, 4 * _concurrency), thread_name_prefix="guardian-llm")
+
+    def __init__(self, api_key=None, model_name="gemini-2.5-flash", fix_cache=None, backend=None):
+        """
+        Cheap to construct: no network calls happen until the model is first
+        used, so importing modules that build a client stays offline.
+        """
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        # Gemini by default; GUARDIAN_LLM_BACKEND=http talks to a local stand-in instead
+        self.backend = backend or get_backend(api_key=self.api_key)
         self.model_name = model_name
-        if not self.api_key:
-            print("WARNING: GEMINI_API_KEY not set. Using Mock LLM mode.")
-            self.model = None
-            self.fallback_model = None
-        else:
-            try:
-                genai.configure(api_key=self.api_key)
-                # Try to list models to confirm API key and see what's available
-                available_models = []
+        self.requested_model_name = model_name
+        if fix_cache is None and os.getenv("GUARDIAN_FIX_CACHE", "1") != "0":
+            fix_cache = FixCache()
+        self.fix_cache = fix_cache or None
+        self.rate_limiter = get_rate_limiter()
+        self.fallback_model_name = os.getenv("GUARDIAN_LLM_FALLBACK_MODEL", "gemini-2.5-flash")
+        self.max_retries = int(os.getenv("GUARDIAN_LLM_RETRIES", 2))
+        self.backoff_base = float(os.getenv("GUARDIAN_LLM_BACKOFF", 1.0))
+        # Per-call deadline in seconds, covering the primary and any hedged request
+        self.deadline = float(os.getenv("GUARDIAN_LLM_DEADLINE", 60))
+        self.hedge = os.getenv("GUARDIAN_LLM_HEDGE", "1") != "0"
+        self.hedge_after_default = float(os.getenv("GUARDIAN_LLM_HEDGE_AFTER", 10))
+        self.production = os.getenv("GUARDIAN_ENV", "development") == "production"
+        # Token and call counters for this client, see usage_snapshot()
+        self.usage = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0}
+        self._usage_lock = threading.Lock()
+        self._model = None
+        self._fallback_model = None
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @property
+    def model(self):
+        self._ensure_model()
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
+        self._initialized = True
+
+    @property
+    def fallback_model(self):
+        self._ensure_model()
+        return self._fallback_model
+
+    @fallback_model.setter
+    def fallback_model(self, value):
+        self._fallback_model = value
+
+    def _ensure_model(self):
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            if not self.backend.is_configured():
+                print("WARNING: GEMINI_API_KEY not set. Using Mock LLM mode.")
+            else:
                 try:
-                    for m in genai.list_models():
-                        if 'generateContent' in m.supported_generation_methods:
-                            available_models.append(m.name)
+                    self.backend.setup()
+                    if self.backend.discovers_models:
+                        self.model_name = self._discover_model_name(self.requested_model_name)
+                    self._model = self.backend.create_model(self.model_name)
+                    self._fallback_model = self.backend.create_model(self.fallback_model_name)
                 except Exception as e:
-                    print(f" [LLM] Warning: Could not list models: {e}")
-
-                if available_models:
-                    print(f" [LLM] Available models: {available_models}")
-                    # If requested model not in list, find a suitable one
-                    current_model_path = f"models/{model_name}"
-                    if current_model_path not in available_models and f"models/{model_name}-latest" not in available_models:
-                        # Fallback to flash if available
-                        flash_models = [m for m in available_models if 'flash' in m]
-                        if flash_models:
-                            self.model_name = flash_models[0].split('/')[-1]
-                            print(f" [LLM] Requested model {model_name} not found. Using {self.model_name}")
-
-                self.model = genai.GenerativeModel(self.model_name)
-                self.fallback_model = genai.GenerativeModel("gemini-2.5-flash")
+                     print(f" [LLM] Initialization error: {e}")
+                     self._model = None
+            self._initialized = True
+
+    def _discover_model_name(self, model_name):
+        """
+        Picks the model to use, listing available models at most once per
+        TTL. The result is cached in memory and on disk so that workers and
+        restarts reuse it.
+        """
+        cache_path = os.getenv("GUARDIAN_MODEL_CACHE", os.path.join(".guardian", "models.json"))
+        ttl = float(os.getenv("GUARDIAN_MODEL_CACHE_TTL", 24 * 3600))
+        key = f"{hashlib.sha256(self.api_key.encode()).hexdigest()[:12]}:{model_name}"
+
+        with LLMClient._discover_lock:
+            entry = LLMClient._discovered.get(key)
+            if entry is None:
+                try:
+                    with open(cache_path) as f:
+                        entry = json.load(f).get(key)
+                except (OSError, ValueError):
+                    entry = None
+            if entry and time.time() - entry["discovered_at"] < ttl:
+                LLMClient._discovered[key] = entry
+                return entry["model_name"]
+
+            chosen = model_name
+            # Try to list models to confirm API key and see what's available
+            available_models = []
+            try:
+                available_models = self.backend.list_models()
             except Exception as e:
-                 print(f" [LLM] Initialization error: {e}")
-                 self.model = None
+                print(f" [LLM] Warning: Could not list models: {e}")
+                # Don't cache a failed discovery; try again next time
+                return chosen
+
+            if available_models:
+                print(f" [LLM] {len(available_models)} models available.")
+                # If requested model not in list, find a suitable one
+                current_model_path = f"models/{model_name}"
+                if current_model_path not in available_models and f"models/{model_name}-latest" not in available_models:
+                    # Fallback to flash if available
+                    flash_models = [m for m in available_models if 'flash' in m]
+                    if flash_models:
+                        chosen = flash_models[0].split('/')[-1]
+                        print(f" [LLM] Requested model {model_name} not found. Using {chosen}")
+
+            entry = {"model_name": chosen, "discovered_at": time.time()}
+            LLMClient._discovered[key] = entry
+            try:
+                try:
+                    with open(cache_path) as f:
+                        stored = json.load(f)
+                except (OSError, ValueError):
+                    stored = {}
+                stored[key] = entry
+                cache_dir = os.path.dirname(cache_path)
+                if cache_dir and not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                with open(cache_path, "w") as f:
+                    json.dump(stored, f)
+            except OSError as e:
+                print(f" [LLM] Warning: Could not write model cache: {e}")
+            return chosen
+
+    def generate_batch_fix(self, filename, issues, code_content, context=None):
+        """
+        Requests fixes for every issue in one file with a single prompt.
+        Returns SEARCH/REPLACE blocks covering all of them. Issues with a
+        cached fix that still applies are answered from the fix cache.
+
+        context: optional ContextSlice of code_content. When given, only the
+        slice is sent to the model instead of the whole file.
+        """
+        cached_response, report, prompt_code = self._plan_batch(filename, issues, code_content, context)
+        if report is None:
+            return cached_response
+        llm_response = self.generate_fix(report, prompt_code)
+        return f"{cached_response}\n{llm_response}" if cached_response else llm_response
+
+    def _plan_batch(self, filename, issues, code_content, context):
+        """
+        Splits a batch into cached fixes and the rest. Returns (cached blocks
+        text, report for the model or None if everything was cached, code to
+        show the model).
+        """
+        with span("llm.prompt", file=filename, issues=len(issues)) as s:
+            planned = self._plan_batch_traced(filename, issues, code_content, context)
+            s.set(cached=planned[1] is None, bytes=len(planned[2] or ""))
+        return planned
+
+    def _plan_batch_traced(self, filename, issues, code_content, context):
+        cached_blocks = []
+        remaining = []
+        for issue in issues:
+            blocks = self.fix_cache.lookup(issue, code_content) if self.fix_cache else None
+            if blocks:
+                cached_blocks.extend(b for b in blocks if b not in cached_blocks)
+            else:
+                remaining.append(issue)
+        if cached_blocks and apply_blocks(code_content, cached_blocks).failed:
+            # Fixes cached for different issues collide; a partial replay could drop half of a fix
+            print(f" [LLM] Fix cache: cached fixes for {filename} conflict, asking the model instead.")
+            cached_blocks, remaining = [], list(issues)
+
+        if cached_blocks:
+            print(f" [LLM] Fix cache: replaying fixes for {len(issues) - len(remaining)} of {len(issues)} issue(s) in {filename}.")
+        cached_response = format_search_replace_blocks(cached_blocks)
+        if not remaining:
+            return cached_response, None, None
+
+        lines = [f"Vulnerabilities in {filename} ({len(remaining)}):"]
+        for i, issue in enumerate(remaining, 1):
+            test_id = f" [{issue['test_id']}]" if issue.get('test_id') else ""
+            lines.append(f"{i}. Line {issue.get('line_number')}{test_id}: {issue.get('issue_text')}")
+        lines.append("Fix ALL of the issues above. Return one or more blocks per issue as needed.")
+        if context is not None:
+            lines.append(f"The code below is an excerpt of {filename}. Lines marked '# ... omitted ...' are not shown; "
+                         "SEARCH sections must match the excerpt exactly and must not include those markers.")
+            code_content = context.text
+        return cached_response, "\n".join(lines), code_content
+
+    def apply_batch_fix(self, filename, issues, code_content, context=None, stream=None):
+        """
+        Generates fixes for all issues in a file and applies them. In
+        streaming mode (GUARDIAN_LLM_STREAM, on by default) each block is
+        checked and staged as soon as it arrives instead of after the whole
+        response. Returns (new content, text of the blocks that applied).
+        """
+        if stream is None:
+            stream = os.getenv("GUARDIAN_LLM_STREAM", "1") != "0"
+        with span("llm.fix_file", file=filename, issues=len(issues), stream=stream) as s:
+            engine = self._apply_batch_fix(filename, issues, code_content, context, stream)
+            s.set(applied=len(engine.applied), failed=len(engine.failed))
+        return engine.content, format_search_replace_blocks(engine.applied)
+
+    def _apply_batch_fix(self, filename, issues, code_content, context, stream):
+        engine = PatchEngine(code_content, context.regions if context else None,
+                             [issue.get("line_number") for issue in issues])
+        # Patching is interleaved with the stream, so its time is summed and recorded once
+        patching = 0.0
+        if stream:
+            for search, replace in self.stream_batch_fix(filename, issues, code_content, context):
+                started = time.perf_counter()
+                applied = engine.apply(search, replace)
+                patching += time.perf_counter() - started
+                if applied:
+                    print(f" [LLM] Staged block {len(engine.applied)} for {filename}.")
+        else:
+            blocks_text = self.generate_batch_fix(filename, issues, code_content, context)
+            started = time.perf_counter()
+            for search, replace in parse_search_replace_blocks(blocks_text):
+                engine.apply(search, replace)
+            patching += time.perf_counter() - started
+        record("patch.apply", patching, blocks=len(engine.applied) + len(engine.failed), failed=len(engine.failed))
+        if engine.failed:
+            print(f" [LLM] Applied {len(engine.applied)} of {len(engine.applied) + len(engine.failed)} block(s) to {filename}.")
+        return engine
+
+    def stream_batch_fix(self, filename, issues, code_content, context=None):
+        """
+        Streaming version of generate_batch_fix: yields (search, replace)
+        blocks one by one. Cached fixes come first; model blocks are yielded
+        as soon as each one's REPLACE marker has been received.
+        """
+        cached_response, report, prompt_code = self._plan_batch(filename, issues, code_content, context)
+        yield from parse_search_replace_blocks(cached_response)
+        if report is not None:
+            yield from self.stream_fix(report, prompt_code)
+
+    def stream_fix(self, vulnerability_report, code_content):
+        """
+        Streams the model's response and yields each SEARCH/REPLACE block
+        as soon as it is complete. The stream is hedged on its first chunk:
+        if the primary is slower than its usual time to first chunk, the
+        fallback model is streamed too and whichever starts first is used.
+        If the stream fails before producing a block, falls back to a
+        regular call with retries and hedging.
+        """
+        self._ensure_model()
+        parser = SearchReplaceStreamParser()
+        if not self.model:
+            yield from parser.feed(self._offline_fix(vulnerability_report, code_content))
+            return
+
+        print(f" [LLM] Streaming prompt to {self.model_name}...")
+        prompt = self._build_prompt(vulnerability_report, code_content)
+        yielded = 0
+        streamed = []
+        usage = None
+        started = time.perf_counter()
+        first_block = None
+        model_name = self.model_name
+        try:
+            # The slot is held until the stream is drained
+            with LLMClient._slots:
+                self.rate_limiter.acquire(self._estimate_tokens(prompt))
+                model_name, first, chunks, started = self._hedged_call(prompt, self._open_stream, "first_chunk")
+                for chunk in itertools.chain([first], chunks):
+                    streamed.append(chunk.text)
+                    # Gemini reports usage on the chunks; the last one has the totals
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    for block in parser.feed(chunk.text):
+                        if first_block is None:
+                            first_block = time.perf_counter() - started
+                        yielded += 1
+                        yield block
+            prompt_tokens, output_tokens = self._record_usage(prompt, "".join(streamed), usage)
+            elapsed = time.perf_counter() - started
+            self._latency(model_name).record(elapsed)
+            record("llm.stream", elapsed, model=model_name, blocks=yielded,
+                   first_block_seconds=first_block, prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                   bytes=len(prompt))
+            print(" [LLM] Stream finished.")
+            return
+        except Exception as e:
+            print(f" [LLM] Stream from {model_name} failed: {e}")
+            LLM_ERRORS.inc(scope="attempt")
+            prompt_tokens, output_tokens = (self._record_usage(prompt, "".join(streamed), usage)
+                                            if streamed else (0, 0))
+            record("llm.stream", time.perf_counter() - started, model=model_name, blocks=yielded,
+                   first_block_seconds=first_block, prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                   bytes=len(prompt), error=str(e))
+            if yielded:
+                return
+
+        try:
+            yield from SearchReplaceStreamParser().feed(self._generate(prompt))
+        except Exception as e:
+            print(f" [LLM] Giving up on {self.model_name} after {self.max_retries + 1} attempt(s): {e}")
+
+    def record_validated_fix(self, issues, code_content, blocks_text):
+        """
+        Stores blocks that produced a validated fix so the same pattern can
+        be replayed later. code_content is the file before the fix.
+        """
+        if not self.fix_cache:
+            return
+        blocks = parse_search_replace_blocks(blocks_text)
+        for issue in issues:
+            self.fix_cache.store(issue, code_content, blocks)
 
     def generate_fix(self, vulnerability_report, code_content):
+        self._ensure_model()
+        if not self.model:
+            return self._offline_fix(vulnerability_report, code_content)
+
         print(f" [LLM] Sending prompt to {self.model_name}...")
+        prompt = self._build_prompt(vulnerability_report, code_content)
         try:
-            if not self.model:
-                raise ValueError("Model not initialized")
-                
-            prompt = f"""
+            text = self._generate(prompt)
+            print(" [LLM] Response received.")
+            return text
+        except Exception as e:
+            print(f" [LLM] Giving up on {self.model_name} after {self.max_retries + 1} attempt(s): {e}")
+            return ""
+
+    def _offline_fix(self, vulnerability_report, code_content):
+        """
+        Used only when no model is configured. The mock is a development aid
+        and never runs in production.
+        """
+        if self.production:
+            print(" [LLM] No model configured; mock fixes are disabled in production.")
+            return ""
+        return self._mock_fix(vulnerability_report, code_content)
+
+    def _generate(self, prompt):
+        """
+        Calls the model with retries (jittered exponential backoff), a
+        per-call deadline and optional hedging. Raises if every attempt fails.
+        """
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = self._backoff(attempt)
+                print(f" [LLM] Retry {attempt}/{self.max_retries} in {delay:.1f}s after: {last_error}")
+                time.sleep(delay)
+            try:
+                with LLMClient._slots:
+                    self.rate_limiter.acquire(self._estimate_tokens(prompt))
+                    return self._hedged_call(prompt)
+            except Exception as e:
+                last_error = e
+                LLM_ERRORS.inc(scope="attempt")
+        LLM_ERRORS.inc(scope="request")
+        raise last_error
+
+    def _backoff(self, attempt):
+        return min(30.0, self.backoff_base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+    def _hedge_after(self, kind="response"):
+        """
+        Seconds to wait for the primary before hedging: its observed p95
+        latency (of whole responses, or of the first chunk for streams) once
+        there are enough samples, otherwise a configured default.
+        """
+        tracker = self._latency(self.model_name, kind)
+        if len(tracker) >= 20:
+            return max(1.0, tracker.percentile(95))
+        return self.hedge_after_default
+
+    def _should_hedge(self, prompt):
+        """
+        True if a hedge may be sent. Takes a concurrency slot for it, which
+        the caller releases once the hedged call finishes.
+        """
+        if not self.hedge or self.fallback_model is None:
+            return False
+        if not LLMClient._slots.acquire(blocking=False):
+            return False
+        if not self.rate_limiter.try_acquire(self._estimate_tokens(prompt)):
+            LLMClient._slots.release()
+            return False
+        return True
+
+    def _latency(self, model_name, kind="response"):
+        with LLMClient._latency_lock:
+            return LLMClient._latencies.setdefault((model_name, kind), LatencyTracker())
+
+    def _timed_call(self, model, model_name, prompt):
+        with span("llm.generate", model=model_name, bytes=len(prompt)) as s:
+            started = time.perf_counter()
+            response = model.generate_content(prompt, request_options={"timeout": self.deadline})
+            text = response.text.strip()
+            prompt_tokens, output_tokens = self._record_usage(prompt, text, getattr(response, "usage_metadata", None))
+            s.set(prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+        if not text:
+            raise ValueError(f"Empty response from {model_name}")
+        self._latency(model_name).record(time.perf_counter() - started)
+        return text
+
+    def _open_stream(self, model, model_name, prompt):
+        """
+        Starts a streamed call and waits for its first chunk. Returns
+        (model name, first chunk, remaining chunks, start time).
+        """
+        started = time.perf_counter()
+        chunks = iter(model.generate_content(prompt, stream=True, request_options={"timeout": self.deadline}))
+        first = next(chunks, None)
+        if first is None:
+            raise ValueError(f"Empty stream from {model_name}")
+        self._latency(model_name, "first_chunk").record(time.perf_counter() - started)
+        return model_name, first, chunks, started
+
+    def _hedged_call(self, prompt, call=None, kind="response"):
+        """
+        Sends the prompt to the primary model. If it has not answered within
+        the hedging threshold, sends it to the fallback model too; the first
+        valid response wins. Losing calls are left to finish in the background.
+
+        call(model, model_name, prompt) makes one request, _timed_call by
+        default; kind selects the latency samples the threshold comes from.
+        """
+        call = call or self._timed_call
+        deadline = time.monotonic() + self.deadline
+        hedge_after = self._hedge_after(kind)
+        futures = {LLMClient._executor.submit(bind(call), self.model, self.model_name, prompt): self.model_name}
+
+        done, _ = wait(futures, timeout=min(hedge_after, self.deadline))
+        if not done and self._should_hedge(prompt):
+            print(f" [LLM] No answer from {self.model_name} after {hedge_after:.1f}s, hedging with {self.fallback_model_name}...")
+            hedge = LLMClient._executor.submit(bind(call), self.fallback_model, self.fallback_model_name, prompt)
+            hedge.add_done_callback(lambda _: LLMClient._slots.release())
+            futures[hedge] = self.fallback_model_name
+
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if futures[future] != self.model_name:
+                        print(f" [LLM] Hedged request to {futures[future]} answered first.")
+                    return future.result()
+                error = future.exception()
+        raise error or TimeoutError(f"No response within {self.deadline:.0f}s")
+
+    def _record_usage(self, prompt, text, usage_metadata=None):
+        """
+        Counts one model call. Uses the token counts reported by the API
+        when available, otherwise the same estimate as the rate limiter.
+        """
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or self._estimate_tokens(prompt)
+        output_tokens = getattr(usage_metadata, "candidates_token_count", None) or self._estimate_tokens(text)
+        with self._usage_lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["output_tokens"] += output_tokens
+        LLM_CALLS.inc()
+        LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+        LLM_TOKENS.inc(output_tokens, kind="output")
+        return prompt_tokens, output_tokens
+
+    def usage_snapshot(self):
+        with self._usage_lock:
+            return dict(self.usage)
+
+    def _estimate_tokens(self, prompt):
+        # Rough rule of thumb (~4 characters per token) is enough for quota pacing
+        return len(prompt) // 4
+
+    def _build_prompt(self, vulnerability_report, code_content):
+        return f"""
             You are a Senior Security Engineer.
             
             Vulnerability Report:
@@ -76,13 +556,6 @@ class LLMClient:
             - Use 'os.environ.get' for secrets.
             - Use 'subprocess.run' with lists for system commands.
             """
-            
-            response = self.model.generate_content(prompt)
-            print(" [LLM] Response received.")
-            return response.text.strip()
-        except Exception as e:
-            print(f" [LLM] Error with {self.model_name}: {e}")
-            return self._mock_fix(vulnerability_report, code_content)
 
     def _mock_fix(self, vulnerability_report, code_content):
         print(" [Mock LLM] Generating fix for SQL Injection, Command Injection, Secrets, Deserialization...")
@@ -133,3 +606,39 @@ if __name__ == "__main__":
         Secondary check if Bandit misses something (optional).
         """
         return "Analysis not implemented yet (relying on Bandit)."
+
+
+SEARCH_REPLACE_PATTERN = r"<<<<<<< SEARCH\n(.*?)\n=======\n(.*?)\n>>>>>>> REPLACE"
+
+def parse_search_replace_blocks(blocks_text: str) -> list:
+    """
+    Returns [(search, replace), ...] for every block in an LLM response.
+    """
+    return re.findall(SEARCH_REPLACE_PATTERN, blocks_text, re.DOTALL)
+
+def format_search_replace_blocks(blocks: list) -> str:
+    """
+    Inverse of parse_search_replace_blocks.
+    """
+    return "\n".join(f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE" for search, replace in blocks)
+
+class SearchReplaceStreamParser:
+    """
+    Incrementally parses SEARCH/REPLACE blocks out of streamed model output.
+    Each call to feed() returns the blocks completed by that chunk.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        blocks = []
+        # Cheap check first: nothing can complete until a REPLACE marker arrives
+        while ">>>>>>> REPLACE" in self._buffer:
+            match = re.search(SEARCH_REPLACE_PATTERN, self._buffer, re.DOTALL)
+            if not match:
+                break
+            blocks.append(match.groups())
+            self._buffer = self._buffer[match.end():]
+        return blocks
@@ -0,0 +1,223 @@
+import math
+import threading
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. webhooks received or tokens used."""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        if not self.labels:
+            # Export unlabelled counters from the start, so rates work before the first event
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down. With function set, the value is read
+    when the metrics are scraped (e.g. queue depth). For a labelled gauge
+    the function returns {label value (or tuple of values): value}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+                if isinstance(value, dict):
+                    values = {key if isinstance(key, tuple) else (key,): v for key, v in value.items()}
+                else:
+                    values = {(): value}
+                values = {tuple(str(part) for part in key): v for key, v in values.items()}
+                with self._lock:
+                    self._values = values
+            except Exception as e:
+                print(f" [Metrics] Could not read {self.name}: {e}")
+        return super().render()
+
+
+class Histogram(_Metric):
+    """Distribution over fixed buckets, e.g. stage latencies."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [per-bucket counts..., sum]
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    In-process metric registry rendered in the Prometheus text format.
+    Updates are a dict operation under a lock, cheap enough to leave on.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labels != metric.labels:
+                    raise ValueError(f"Metric {metric.name} is already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=(), function=None):
+    metric = REGISTRY.register(Gauge(name, documentation, labels, function))
+    if function is not None:
+        metric.function = function
+    return metric
+
+
+def histogram(name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+# Metrics shared across modules
+WEBHOOKS = counter("guardian_webhooks_total", "Webhook deliveries by event and outcome.", ["event", "outcome"])
+RUNS = counter("guardian_runs_total", "Finished PR runs by mode and outcome.", ["mode", "outcome"])
+RUN_SECONDS = histogram("guardian_run_seconds", "Wall time of PR runs.", ["mode"])
+STAGE_SECONDS = histogram("guardian_stage_seconds", "Wall time of run stages and agent tools.", ["stage"])
+FINDINGS = histogram("guardian_run_findings", "Security findings per PR run.", buckets=COUNT_BUCKETS)
+LLM_CALLS = counter("guardian_llm_calls_total", "Successful LLM calls.")
+LLM_TOKENS = counter("guardian_llm_tokens_total", "LLM tokens used.", ["kind"])
+LLM_ERRORS = counter("guardian_llm_errors_total",
+                     "Failed LLM attempts, and requests that failed after every retry.", ["scope"])
+CACHE_LOOKUPS = counter("guardian_cache_lookups_total", "Disk cache lookups.", ["cache", "result"])
+FIX_BLOCKS = counter("guardian_fix_blocks_total", "Fix blocks kept or reverted by validation.", ["outcome"])
+PUSH_FAILURES = counter("guardian_push_failures_total", "Pushes of fixes that failed.")
+
+
+def observe_run(summary):
+    """Records the outcome, duration, findings and stage timings of a run summary."""
+    mode = summary.get("mode", "pipeline")
+    if summary.get("error"):
+        outcome = "error"
+    elif summary.get("cancelled"):
+        outcome = "cancelled"
+    else:
+        outcome = "success"
+    RUNS.inc(mode=mode, outcome=outcome)
+    if summary.get("seconds") is not None:
+        RUN_SECONDS.observe(summary["seconds"], mode=mode)
+    if "issues" in summary:
+        FINDINGS.observe(summary["issues"])
+    for stage, seconds in summary.get("timings", {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
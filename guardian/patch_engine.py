@@ -0,0 +1,242 @@
+import bisect
+import difflib
+
+
+def _normalize(line):
+    """Line with all runs of whitespace collapsed, for indentation-tolerant matching."""
+    return " ".join(line.split())
+
+
+def _indent(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _strip_blank_edges(lines):
+    start, end = 0, len(lines)
+    while start < end and not lines[start].strip():
+        start += 1
+    while end > start and not lines[end - 1].strip():
+        end -= 1
+    return lines[start:end]
+
+
+class PatchEngine:
+    """
+    Applies SEARCH/REPLACE blocks to a file, one block at a time.
+
+    The file is indexed by normalized line, so finding a block costs a
+    dictionary lookup plus a check of each candidate position instead of a
+    scan of the whole file. Lines are compared with whitespace collapsed,
+    so a block whose indentation or spacing differs from the file still
+    matches; its replacement is re-indented line by line to the file's
+    indentation, and the block fails if that mapping is ambiguous.
+
+    Each block replaces exactly one occurrence: the exact match over a
+    fuzzy one, then the one closest to a finding line (anchors, 1-based).
+    With regions (1-based inclusive line ranges, e.g. from a ContextSlice)
+    the match must start inside a region.
+
+    applied holds the (search, replace) text actually spliced into the
+    file, with \n line endings so it can be applied again, spans the
+    1-based line range each one now occupies, and failed the blocks that
+    could not be placed.
+    """
+
+    def __init__(self, content, regions=None, anchors=None):
+        self.lines = content.splitlines(keepends=True)
+        self._normalized = [_normalize(l) for l in self.lines]
+        self.regions = list(regions) if regions else None
+        self.anchors = sorted(a for a in (anchors or []) if a)
+        self.applied = []
+        self.spans = []
+        self.failed = []
+        self._index = None
+
+    @property
+    def content(self):
+        return "".join(self.lines)
+
+    def apply(self, search, replace):
+        """Applies one block; returns False if its SEARCH text could not be placed."""
+        # Blocks are handled with \n endings; the file's own line endings are restored on output
+        search, replace = search.replace("\r\n", "\n"), replace.replace("\r\n", "\n")
+        match = self._locate(search)
+        if match is None:
+            print(f" [Patch] Warning: SEARCH block not found: {_normalize(search)[:80]!r}")
+            self.failed.append((search, replace))
+            return False
+
+        start, end, exact = match
+        original = self.lines[start:end]
+        new_lines = self._replacement_lines(search, replace, original, exact)
+        if new_lines is None:
+            print(f" [Patch] Warning: could not map the block's indentation onto line {start + 1}, skipping it.")
+            self.failed.append((search, replace))
+            return False
+
+        self.lines[start:end] = new_lines
+        self._reindex(start, end, new_lines)
+        self._shift(start + 1, end - start, len(new_lines))
+        self.spans.append((start + 1, start + max(1, len(new_lines))))
+        self.applied.append(("".join(original).replace("\r\n", "\n").rstrip("\n"),
+                             "".join(new_lines).replace("\r\n", "\n").rstrip("\n")))
+        if not exact:
+            print(f" [Patch] Applied block at line {start + 1} with whitespace-tolerant matching.")
+        return True
+
+    def _build_index(self):
+        index = {}
+        for i, key in enumerate(self._normalized):
+            if key:
+                index.setdefault(key, []).append(i)
+        self._index = index
+
+    def _reindex(self, start, end, new_lines):
+        new_keys = [_normalize(l) for l in new_lines]
+        old_keys = self._normalized[start:end]
+        self._normalized[start:end] = new_keys
+        if self._index is None:
+            return
+        if len(new_keys) != len(old_keys):
+            # Every later position moved; rebuild lazily on the next lookup
+            self._index = None
+            return
+        for i, (old, new) in enumerate(zip(old_keys, new_keys), start):
+            if old == new:
+                continue
+            if old:
+                self._index[old].remove(i)
+            if new:
+                bisect.insort(self._index.setdefault(new, []), i)
+
+    def _locate(self, search):
+        """
+        (start, end, exact) line span of the best match for search, or None.
+        """
+        search_lines = _strip_blank_edges(search.split("\n"))
+        if not search_lines:
+            return None
+        if self._index is None:
+            self._build_index()
+
+        normalized = [_normalize(l) for l in search_lines]
+        # Probe the index with the rarest line of the block to keep candidates few
+        probes = [(len(self._index.get(key, ())), offset) for offset, key in enumerate(normalized) if key]
+        count, offset = min(probes)
+        if not count:
+            return None
+
+        size = len(search_lines)
+        best = None
+        for position in self._index[normalized[offset]]:
+            start = position - offset
+            if start < 0 or start + size > len(self.lines):
+                continue
+            if self._normalized[start:start + size] != normalized:
+                continue
+            window = self.lines[start:start + size]
+            if self.regions is not None and not any(s <= start + 1 <= e for s, e in self.regions):
+                continue
+            exact = [l.rstrip("\r\n") for l in window] == search_lines
+            rank = (not exact, self._distance(start + 1, start + size), start)
+            if best is None or rank < best[0]:
+                best = (rank, start, exact)
+        if best is None:
+            return None
+        return best[1], best[1] + size, best[2]
+
+    def _distance(self, first, last):
+        """Lines between the span [first, last] and the nearest anchor."""
+        if not self.anchors:
+            return 0
+        return min(0 if first <= a <= last else min(abs(a - first), abs(a - last)) for a in self.anchors)
+
+    def _replacement_lines(self, search, replace, original, exact):
+        """
+        File lines that replace original, or None if the replacement's
+        indentation cannot be mapped onto the file.
+        """
+        newline = "\r\n" if original[-1].endswith("\r\n") else "\n"
+        replace_lines = replace.split("\n") if replace else []
+
+        if not exact:
+            replace_lines = self._reindent(_strip_blank_edges(search.split("\n")), replace_lines, original)
+            if replace_lines is None:
+                return None
+
+        lines = [l + newline for l in replace_lines]
+        if lines and not original[-1].endswith("\n"):
+            lines[-1] = lines[-1][:-len(newline)]
+        return lines
+
+    @staticmethod
+    def _reindent(search_lines, replace_lines, original):
+        """
+        Re-indents the replacement of a fuzzy match. search_lines lines up
+        with original line by line. Each replacement line is indented
+        relative to the SEARCH line it corresponds to (the same line, the
+        one it replaces, or the one it follows), so a block whose
+        indentation was stripped still lands at each line's own depth.
+        """
+        search_indents = [_indent(l) for l in search_lines]
+        file_indents = [_indent(l.rstrip("\r\n")) for l in original]
+        # SEARCH indent -> file indent; None where one SEARCH indent stands for several file levels
+        levels = {}
+        nonblank = []
+        for i, line in enumerate(search_lines):
+            if line.strip():
+                nonblank.append(i)
+                s, f = search_indents[i], file_indents[i]
+                levels[s] = f if levels.get(s, f) == f else None
+
+        matcher = difflib.SequenceMatcher(None, [_normalize(l) for l in search_lines],
+                                          [_normalize(l) for l in replace_lines], autojunk=False)
+        reference = [0] * len(replace_lines)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            for j in range(j1, j2):
+                if tag == "equal":
+                    reference[j] = i1 + j - j1
+                elif tag == "replace":
+                    reference[j] = min(i1 + j - j1, i2 - 1)
+                else:
+                    reference[j] = max(i1 - 1, 0)
+
+        result = []
+        for line, ref in zip(replace_lines, reference):
+            if not line.strip():
+                result.append(line)
+                continue
+            # Nearest non-blank SEARCH line at or before the reference
+            ref = max((i for i in nonblank if i <= ref), default=nonblank[0])
+            indent = _indent(line)
+            if indent.startswith(search_indents[ref]):
+                new_indent = file_indents[ref] + indent[len(search_indents[ref]):]
+            else:
+                # Shallower than its reference: only safe if the block uses that indent consistently
+                new_indent = levels.get(indent)
+                if new_indent is None:
+                    return None
+            result.append(new_indent + line.lstrip())
+        return result
+
+    def _shift(self, line, old_count, new_count):
+        """Keeps regions, anchors and spans after the edited span pointing at the same code."""
+        delta = new_count - old_count
+        if not delta:
+            return
+        last = line + old_count - 1
+        if self.regions is not None:
+            self.regions = [(s + (delta if s > last else 0), e + (delta if e >= last else 0)) for s, e in self.regions]
+        self.anchors = [a + delta if a > last else a for a in self.anchors]
+        self.spans = [(s + delta, e + delta) if s > last else (s, e) for s, e in self.spans]
+
+
+def apply_blocks(content, blocks, regions=None, anchors=None):
+    """
+    Applies [(search, replace), ...] and returns the PatchEngine, whose
+    content, applied and failed attributes describe the outcome.
+    """
+    engine = PatchEngine(content, regions, anchors)
+    for search, replace in blocks:
+        engine.apply(search, replace)
+    return engine
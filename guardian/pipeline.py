@@ -0,0 +1,57 @@
+import asyncio
+import os
+import time
+from . import tools
+from .agent import SecurityAgent
+
+# "pipeline" runs the steps in code; "agent" lets the Gemini agent plan every tool call
+MODES = ("pipeline", "agent")
+
+_agent = None
+
+
+def get_mode(mode=None):
+    mode = (mode or os.getenv("GUARDIAN_MODE", "pipeline")).lower()
+    if mode not in MODES:
+        raise ValueError(f"Unknown GUARDIAN_MODE '{mode}'. Choose one of: {', '.join(MODES)}")
+    return mode
+
+
+def _get_agent():
+    """
+    SecurityAgent built on the same components as the ADK tools, so both
+    modes share the git mirror, caches, rate limiter and LLM counters.
+    """
+    global _agent
+    if _agent is None:
+        _agent = SecurityAgent(git_ops=tools.git_ops, analyzer=tools.bandit_analyzer,
+                               llm=tools.llm, gitea=tools.gitea_client)
+    return _agent
+
+
+def usage_delta(before, after):
+    return {key: after[key] - before[key] for key in after}
+
+
+async def run_pipeline(repo_url, repo_owner, repo_name, pr_number, branch_name, base_branch="", should_cancel=None):
+    """
+    Deterministic fast path: analyze -> fix -> validate -> commit -> comment
+    run directly in code. The LLM is only called to generate fixes.
+
+    Returns the run summary with mode, wall time and LLM usage. Usage is
+    measured on the shared client, so it includes any runs overlapping
+    this one.
+    """
+    print(f" [Pipeline] Starting security run for PR #{pr_number} in {repo_name}...")
+    started = time.perf_counter()
+    before = tools.llm.usage_snapshot()
+
+    summary = await asyncio.to_thread(_get_agent().run_pr, repo_url, repo_owner, repo_name, pr_number,
+                                      branch_name, base_branch or None, should_cancel)
+
+    summary.update(usage_delta(before, tools.llm.usage_snapshot()))
+    summary["mode"] = "pipeline"
+    summary["seconds"] = time.perf_counter() - started
+    print(f" [Pipeline] PR #{pr_number} done in {summary['seconds']:.1f}s: {summary['issues']} issue(s), "
+          f"{len(summary['fixed_files'])} file(s) fixed, {summary['calls']} LLM call(s).")
+    return summary
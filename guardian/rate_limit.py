@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Two token buckets (requests per minute and tokens per minute) shared by
+    every thread in the process (SecurityAgent's fixer pool, ADK tool
+    threads). Each call reserves one request and its estimated token
+    count, waiting until both fit.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = float(requests_per_minute or os.getenv("GUARDIAN_LLM_RPM", 60))
+        self.tokens_per_minute = float(tokens_per_minute or os.getenv("GUARDIAN_LLM_TPM", 1000000))
+        self._requests = self.requests_per_minute
+        self._tokens = self.tokens_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        """
+        Takes capacity if available and returns 0, otherwise returns how
+        many seconds to wait before trying again.
+        """
+        # A single oversized request must still be able to go through eventually
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0
+
+            wait_requests = (1 - self._requests) * 60 / self.requests_per_minute
+            wait_tokens = (tokens - self._tokens) * 60 / self.tokens_per_minute
+            return max(wait_requests, wait_tokens, 0.01)
+
+    def try_acquire(self, tokens=0):
+        """Reserves capacity only if it is available right now."""
+        return not self._reserve(tokens)
+
+    def acquire(self, tokens=0):
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process-wide limiter used by every LLMClient."""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
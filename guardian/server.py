@@ -1,13 +1,18 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import os
-import threading
 import asyncio
 import sys
+from .job_queue import JobQueue, WorkerPool, QueueFullError
+from .metrics import REGISTRY, WEBHOOKS, gauge
 
 app = Flask(__name__)
 
-def run_agent_in_thread(data):
-    """Bridge for running the async ADK agent from a sync thread."""
+def pr_key(data):
+    """Coalescing key for a pull_request payload: one per (repo, PR)."""
+    return f"{data['repository']['owner']['username']}/{data['repository']['name']}#{data['number']}"
+
+def run_agent_in_thread(data, should_cancel=None):
+    """Bridge for running the async ADK agent from a sync worker thread."""
     from .adk_agent import run_guardian_on_pr
     
     repo_url = data['repository']['clone_url']
@@ -20,14 +25,26 @@ def run_agent_in_thread(data):
     repo_name = data['repository']['name']
     pr_number = data['number']
     branch_name = data['pull_request']['head']['ref']
+    base_branch = data['pull_request'].get('base', {}).get('ref', '')
     
     try:
-        asyncio.run(run_guardian_on_pr(repo_url, repo_owner, repo_name, pr_number, branch_name))
+        asyncio.run(run_guardian_on_pr(repo_url, repo_owner, repo_name, pr_number, branch_name,
+                                       base_branch=base_branch, should_cancel=should_cancel))
     except Exception as e:
         print(f" [ADK Agent] Error during execution: {e}")
         import traceback
         traceback.print_exc()
         sys.stdout.flush()
+        raise
+
+job_queue = JobQueue()
+worker_pool = WorkerPool(job_queue, run_agent_in_thread)
+DEBOUNCE_SECONDS = float(os.environ.get('GUARDIAN_DEBOUNCE_SECONDS', 5))
+
+# Read from the queue when /metrics is scraped
+gauge("guardian_jobs", "Jobs in the queue by status.", ["status"], function=job_queue.depth)
+gauge("guardian_runs_in_flight", "PR runs currently being processed.", function=lambda: worker_pool.in_flight)
+gauge("guardian_workers", "Size of the worker pool.", function=lambda: worker_pool.size)
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
@@ -41,20 +58,44 @@ def webhook():
     if event_type == 'pull_request':
         
         if action in ['opened', 'reopened', 'synchronized']:
-            print(f" [WEBHOOK] Triggering ADK Agent for PR #{data.get('number')}...")
+            worker_pool.start()
+            try:
+                head_sha = data.get('pull_request', {}).get('head', {}).get('sha')
+                job_id = job_queue.put(data, key=pr_key(data), head_sha=head_sha, delay=DEBOUNCE_SECONDS)
+            except QueueFullError as e:
+                print(f" [WEBHOOK] Queue full, rejecting PR #{data.get('number')}: {e}")
+                WEBHOOKS.inc(event=event_type, outcome="rejected")
+                sys.stdout.flush()
+                return jsonify({'status': 'queue_full', 'queue': job_queue.depth()}), 429
+
+            print(f" [WEBHOOK] Queued ADK Agent run {job_id} for PR #{data.get('number')}...")
+            WEBHOOKS.inc(event=event_type, outcome="queued")
             sys.stdout.flush()
-            # Run ADK agent in background
-            thread = threading.Thread(target=run_agent_in_thread, args=(data,))
-            thread.start()
-            
-            return jsonify({'status': 'processing', 'message': 'Guardian ADK Agent started'}), 202
+            return jsonify({'status': 'queued', 'job_id': job_id, 'queue': job_queue.depth()}), 202
     
     print(f" [WEBHOOK] Ignored event: {event_type}")
+    WEBHOOKS.inc(event=event_type or "unknown", outcome="ignored")
     sys.stdout.flush()
     return jsonify({'status': 'ignored'}), 200
 
+@app.route('/queue', methods=['GET'])
+def queue_status():
+    return jsonify({
+        'queue': job_queue.depth(),
+        'max_pending': job_queue.max_pending,
+        'workers': worker_pool.size,
+        'in_flight': worker_pool.in_flight
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 def run_server():
     port = int(os.environ.get('PORT', 5000))
+    # Only the serving process recovers jobs, never a spawned process re-importing this module
+    job_queue.recover()
+    worker_pool.start()
     app.run(host='0.0.0.0', port=port)
 
 if __name__ == '__main__':
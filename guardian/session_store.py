@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from google.adk.sessions.base_session_service import BaseSessionService
+from google.adk.sessions.in_memory_session_service import InMemorySessionService
+
+
+class BoundedSessionService(BaseSessionService):
+    """
+    Session service for the long-running server: wraps another ADK session
+    service and keeps the number and age of stored sessions bounded.
+
+    - At most max_sessions are kept; the least recently used idle ones go first.
+    - Sessions idle for longer than ttl seconds are deleted.
+    - release() is called when a run finishes. Without persistence the
+      session is deleted right away, since nothing reads it afterwards.
+      With persistence it stays on disk until the limits evict it.
+
+    Sessions of runs still in progress are never evicted.
+    """
+
+    def __init__(self, inner=None, max_sessions=None, ttl=None, persistent=False):
+        self.inner = inner or InMemorySessionService()
+        self.max_sessions = int(max_sessions or os.getenv("GUARDIAN_SESSION_MAX", 100))
+        self.ttl = float(ttl or os.getenv("GUARDIAN_SESSION_TTL", 24 * 3600))
+        self.persistent = persistent
+        self.evictions = 0
+        # (app_name, user_id, session_id) -> last used time, least recently used first
+        self._sessions = OrderedDict()
+        self._active = set()
+        self._adopted_apps = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        In memory by default. GUARDIAN_SESSION_DB (an SQLAlchemy URL such as
+        sqlite:///.guardian/sessions.db) keeps sessions on disk instead.
+        """
+        db_url = os.getenv("GUARDIAN_SESSION_DB")
+        if not db_url:
+            return cls()
+        from google.adk.sessions.database_session_service import DatabaseSessionService
+        if db_url.startswith("sqlite:///"):
+            db_dir = os.path.dirname(db_url[len("sqlite:///"):])
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+        return cls(DatabaseSessionService(db_url=db_url), persistent=True)
+
+    async def create_session(self, *, app_name, user_id, state=None, session_id=None):
+        await self._adopt(app_name)
+        # Make room for the session about to be created
+        await self._evict(room=1)
+        session = await self.inner.create_session(app_name=app_name, user_id=user_id, state=state,
+                                                  session_id=session_id)
+        with self._lock:
+            key = (app_name, user_id, session.id)
+            self._sessions[key] = time.time()
+            self._active.add(key)
+        return session
+
+    async def get_session(self, *, app_name, user_id, session_id, config=None):
+        session = await self.inner.get_session(app_name=app_name, user_id=user_id, session_id=session_id,
+                                               config=config)
+        if session is not None:
+            self._touch((app_name, user_id, session_id))
+        return session
+
+    async def list_sessions(self, *, app_name, user_id=None):
+        return await self.inner.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(self, *, app_name, user_id, session_id):
+        with self._lock:
+            self._sessions.pop((app_name, user_id, session_id), None)
+            self._active.discard((app_name, user_id, session_id))
+        await self.inner.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def append_event(self, session, event):
+        self._touch((session.app_name, session.user_id, session.id))
+        return await self.inner.append_event(session, event)
+
+    async def release(self, *, app_name, user_id, session_id):
+        """Marks a run as finished, deleting its session unless sessions are persisted."""
+        key = (app_name, user_id, session_id)
+        with self._lock:
+            self._active.discard(key)
+            tracked = key in self._sessions
+        if tracked and not self.persistent:
+            await self.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        await self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "active": len(self._active), "evictions": self.evictions}
+
+    async def _adopt(self, app_name):
+        """
+        Starts tracking sessions a persistent store kept from earlier
+        processes, so they count towards the limits too.
+        """
+        if not self.persistent or app_name in self._adopted_apps:
+            return
+        self._adopted_apps.add(app_name)
+        try:
+            response = await self.inner.list_sessions(app_name=app_name)
+        except Exception as e:
+            print(f" [Sessions] Could not list stored sessions: {e}")
+            return
+        with self._lock:
+            for session in sorted(response.sessions, key=lambda s: s.last_update_time or 0, reverse=True):
+                key = (app_name, session.user_id, session.id)
+                if key not in self._sessions:
+                    self._sessions[key] = session.last_update_time or time.time()
+                    self._sessions.move_to_end(key, last=False)
+
+    def _touch(self, key):
+        with self._lock:
+            if key in self._sessions:
+                self._sessions[key] = time.time()
+                self._sessions.move_to_end(key)
+
+    async def _evict(self, room=0):
+        now = time.time()
+        with self._lock:
+            idle = [key for key in self._sessions if key not in self._active]
+            expired = [key for key in idle if now - self._sessions[key] > self.ttl]
+            overflow = len(self._sessions) - len(expired) - self.max_sessions + room
+            expired_keys = set(expired)
+            stale = expired + [key for key in idle if key not in expired_keys][:max(0, overflow)]
+        for app_name, user_id, session_id in stale:
+            try:
+                await self.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+                self.evictions += 1
+            except Exception as e:
+                print(f" [Sessions] Could not evict session {session_id}: {e}")
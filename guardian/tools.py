@@ -1,9 +1,18 @@
+import asyncio
+import functools
 import os
+import threading
 import time
+import weakref
 from .git_ops import GitOps
 from .analyzer import Analyzer
 from .llm_client import LLMClient
 from .gitea_client import GiteaClient
+from .context import extract_context
+from .llm_client import format_search_replace_blocks, parse_search_replace_blocks
+from .validation import FileFix, FixValidator
+from .metrics import STAGE_SECONDS
+from .tracing import span
 import git
 
 from typing import Any
@@ -13,8 +22,39 @@ git_ops = GitOps()
 bandit_analyzer = Analyzer()
 llm = LLMClient()
 gitea_client = GiteaClient()
+validator = FixValidator(bandit_analyzer)
 
-def analyze_pr_vulnerabilities(repo_url: str, repo_name: str, pr_number: int, branch_name: str) -> dict:
+# Tool calls can run concurrently (see the *_async tools); edits to one file,
+# and git operations on one checkout, must not interleave
+class _PathLock:
+    """threading.Lock that can be weakly referenced."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquire = self._lock.acquire
+        self.release = self._lock.release
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+# A lock lives only while a caller holds or waits on it, so the locks of
+# each run's checkout go away with the run instead of piling up
+_path_locks = weakref.WeakValueDictionary()
+_path_locks_guard = threading.Lock()
+
+def _path_lock(path: str) -> _PathLock:
+    key = os.path.realpath(path)
+    with _path_locks_guard:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = _PathLock()
+        return lock
+
+def analyze_pr_vulnerabilities(repo_url: str, repo_name: str, pr_number: int, branch_name: str, base_branch: str = "") -> dict:
     """
     Clones the repository for a specific PR and branch, and runs security analysis using Bandit.
     
@@ -23,6 +63,7 @@ def analyze_pr_vulnerabilities(repo_url: str, repo_name: str, pr_number: int, br
         repo_name: The name of the repository.
         pr_number: The pull request ID.
         branch_name: The branch to analyze.
+        base_branch: The branch the PR targets. When given, only files changed by the PR are analyzed.
         
     Returns:
         A dictionary containing the list of security issues and the path to the cloned repository.
@@ -31,7 +72,8 @@ def analyze_pr_vulnerabilities(repo_url: str, repo_name: str, pr_number: int, br
     repo, repo_path = git_ops.clone_repo(repo_url, repo_dir)
     git_ops.checkout_branch(repo, branch_name)
     
-    issues = bandit_analyzer.run_bandit(repo_path)
+    files, changed_lines = git_ops.pr_scope(repo, base_branch)
+    issues = bandit_analyzer.run_bandit(repo_path, files=files, changed_lines=changed_lines)
     return {
         "status": "success",
         "issues": issues,
@@ -52,34 +94,66 @@ def fix_code_vulnerability(filename: str, line_number: int, issue_text: str, rep
     Returns:
         A dictionary with the fix status.
     """
+    return _fix_file(filename, [{"line_number": line_number, "issue_text": issue_text}], repo_path)
+
+def fix_file_vulnerabilities(filename: str, issues: list[dict], repo_path: str) -> dict:
+    """
+    Fixes every reported vulnerability in one file with a single LLM request.
+    
+    Args:
+        filename: Path to the vulnerable file relative to repo root.
+        issues: The issues reported for this file, each with 'line_number', 'issue_text' and optionally 'test_id'.
+        repo_path: The absolute path to the local repository.
+        
+    Returns:
+        A dictionary with the fix status.
+    """
+    return _fix_file(filename, issues, repo_path)
+
+def _fix_file(filename: str, issues: list, repo_path: str) -> dict:
+    """
+    Requests SEARCH/REPLACE blocks for all issues in a file and applies them together.
+    """
     target_file = os.path.join(repo_path, filename) if not os.path.isabs(filename) else filename
     
     if not os.path.exists(target_file):
         return {"status": "error", "message": f"File not found: {filename}"}
 
+    # Read, fix, validate and write as one step per file
+    with _path_lock(target_file):
+        return _fix_file_locked(filename, issues, repo_path, target_file)
+
+def _fix_file_locked(filename: str, issues: list, repo_path: str, target_file: str) -> dict:
     with open(target_file, 'r') as f:
         content = f.read()
 
-    print(f" [ADK Tool] Fixing '{issue_text}' in {filename} (line {line_number})...")
-    
-    # Construct a focused report for the LLM
-    vulnerability_report = f"Vulnerability: {issue_text}\nLocation: {filename} (near line {line_number})"
+    for issue in issues:
+        print(f" [ADK Tool] Fixing '{issue.get('issue_text')}' in {filename} (line {issue.get('line_number')})...")
     
-    # Request surgical blocks from LLM
-    blocks_text = llm.generate_fix(vulnerability_report, content)
+    # Request surgical blocks for all issues in this file at once, showing
+    # the model only the code around the findings for large files
+    context = extract_context(content, [issue.get('line_number') for issue in issues])
     
-    # Parse and apply blocks
-    new_content = _apply_search_replace_blocks(content, blocks_text)
+    # Blocks are parsed and applied as they stream in
+    new_content, blocks_text = llm.apply_batch_fix(filename, issues, content, context=context)
     
     if new_content == content:
         print(f" [ADK Tool] No changes applied to {filename}. Block might not have matched.")
         return {"status": "warning", "message": "No changes applied. Possible block match failure."}
 
+    # Compile and re-scan the patched file, reverting any block that fails
+    fix = FileFix(target_file, content, parse_search_replace_blocks(blocks_text), issues,
+                  context.regions if context else None)
+    validator.validate(repo_path, [fix])
+    if not fix.changed:
+        print(f" [ADK Tool] Fix for {filename} failed validation and was reverted.")
+        return {"status": "error", "message": "Fix failed validation (syntax or re-scan) and was reverted."}
+
     # Calculate diff for logging
     import difflib
     diff = difflib.unified_diff(
         content.splitlines(keepends=True),
-        new_content.splitlines(keepends=True),
+        fix.content.splitlines(keepends=True),
         fromfile=f'a/{filename}',
         tofile=f'b/{filename}'
     )
@@ -87,35 +161,17 @@ def fix_code_vulnerability(filename: str, line_number: int, issue_text: str, rep
     if diff_text:
         print(f" [ADK Tool] Diff for {filename}:\n{diff_text}")
 
-    with open(target_file, 'w') as f:
-        f.write(new_content)
-        
-    return {"status": "success", "filename": filename, "fixed_file_abs": target_file}
+    # Only validated fixes are worth replaying from the fix cache
+    llm.record_validated_fix(issues, content, format_search_replace_blocks(fix.kept))
 
-def _apply_search_replace_blocks(content: str, blocks_text: str) -> str:
-    """
-    Surgically applies SEARCH/REPLACE blocks to the content.
-    """
-    import re
-    # Pattern to match SEARCH/REPLACE blocks
-    pattern = r"<<<<<<< SEARCH\n(.*?)\n=======\n(.*?)\n>>>>>>> REPLACE"
-    blocks = re.findall(pattern, blocks_text, re.DOTALL)
-    
-    result_content = content
-    for search, replace in blocks:
-        # We use re.escape for the search text but we need to handle the fact that
-        # the model might vary slightly in whitespace if we are not careful.
-        # However, for surgical precision, exact match is preferred.
-        if search in result_content:
-            result_content = result_content.replace(search, replace)
-        else:
-            # Try a slightly more relaxed match by stripping trailing whitespace per line
-            search_lines = [l.rstrip() for l in search.splitlines()]
-            # This is complex to implement robustly without a library, 
-            # so for now we'll stick to exact match and suggest the model be precise.
-            print(f" [ADK Tool] Warning: SEARCH block not found in file content. Exact match required.")
-            
-    return result_content
+    return {
+        "status": "success",
+        "filename": filename,
+        "fixed_file_abs": target_file,
+        "issues_addressed": len(issues) - len(fix.unresolved),
+        "blocks_reverted": fix.reverted,
+        "unresolved": [{"line_number": i["line_number"], "issue_text": i["issue_text"]} for i in fix.unresolved],
+    }
 
 def commit_and_push_fixes(repo_path: str, branch_name: str, fixed_files: str) -> dict:
     """
@@ -136,16 +192,47 @@ def commit_and_push_fixes(repo_path: str, branch_name: str, fixed_files: str) ->
     if not files_list:
         return {"status": "error", "message": "No files provided in the string."}
 
+    # Wait for in-flight fixes to these files, and for other git operations on this checkout
+    locks = [_path_lock(repo_path)] + [_path_lock(os.path.join(repo_path, f)) for f in files_list]
+    locks = sorted(set(locks), key=id)
+    for lock in locks:
+        lock.acquire()
     try:
         repo = git.Repo(repo_path)
         git_ops.commit_and_push(repo, files_list, "chore: Security fixes by Guardian Agent (ADK)", branch_name)
         return {"status": "success", "message": f"Pushed {len(files_list)} files."}
     except Exception as e:
         return {"status": "error", "message": str(e)}
+    finally:
+        for lock in reversed(locks):
+            lock.release()
 
 def comment_on_pr(repo_owner: str, repo_name: str, pr_number: int, message: str) -> dict:
     """
     Posts a comment to the specified Pull Request on Gitea.
     """
-    gitea_client.post_comment(repo_owner, repo_name, pr_number, message)
+    # Added to Guardian's single status comment on the PR instead of a new comment
+    gitea_client.status_comment(repo_owner, repo_name, pr_number).update(message)
     return {"status": "success"}
+
+def _run_in_thread(tool):
+    """
+    Async version of a blocking tool. The ADK runner awaits async tools
+    concurrently when the model issues several calls in one turn; the
+    wrapper keeps the name, signature and docstring the model sees.
+    """
+    @functools.wraps(tool)
+    async def async_tool(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with span(f"tool.{tool.__name__}"):
+                return await asyncio.to_thread(tool, *args, **kwargs)
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=f"tool.{tool.__name__}")
+    return async_tool
+
+analyze_pr_vulnerabilities_async = _run_in_thread(analyze_pr_vulnerabilities)
+fix_code_vulnerability_async = _run_in_thread(fix_code_vulnerability)
+fix_file_vulnerabilities_async = _run_in_thread(fix_file_vulnerabilities)
+commit_and_push_fixes_async = _run_in_thread(commit_and_push_fixes)
+comment_on_pr_async = _run_in_thread(comment_on_pr)
@@ -0,0 +1,174 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+_current_span = contextvars.ContextVar("guardian_span", default=None)
+
+
+class Span:
+    """
+    One timed stage of a PR run. Spans of a run share a trace_id and point
+    at their parent, so the exported lines form a tree.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self.attributes = dict(attributes or {})
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key, amount):
+        """Increments a numeric attribute, e.g. bytes or tokens."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def finish(self, duration=None):
+        self.duration = duration if duration is not None else time.perf_counter() - self._started
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+
+class Tracer:
+    """
+    Collects finished spans per trace and appends the whole tree as JSON
+    lines to GUARDIAN_TRACE_FILE (default .guardian/traces.jsonl) when the
+    root span ends. Spans that end after their root are written directly.
+    """
+
+    def __init__(self, path=None, enabled=None):
+        self.path = path or os.getenv("GUARDIAN_TRACE_FILE", os.path.join(".guardian", "traces.jsonl"))
+        self.enabled = enabled if enabled is not None else os.getenv("GUARDIAN_TRACING", "1") != "0"
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def started(self, span):
+        if span.parent_id is None:
+            with self._lock:
+                self._open[span.trace_id] = []
+
+    def finished(self, span):
+        with self._lock:
+            spans = self._open.get(span.trace_id)
+            if spans is not None:
+                spans.append(span)
+                if span.parent_id is not None:
+                    return
+                del self._open[span.trace_id]
+            else:
+                spans = [span]
+        self._export(spans)
+        if span.parent_id is None:
+            self._report(span, spans)
+
+    def _export(self, spans):
+        try:
+            trace_dir = os.path.dirname(self.path)
+            if trace_dir and not os.path.exists(trace_dir):
+                os.makedirs(trace_dir, exist_ok=True)
+            lines = "".join(json.dumps(s.to_dict(), default=str) + "\n" for s in spans)
+            with self._lock, open(self.path, "a") as f:
+                f.write(lines)
+        except OSError as e:
+            print(f" [Trace] Could not write traces: {e}")
+
+    def _report(self, root, spans):
+        """Prints the run time and the stage with the most time of its own."""
+        children = {}
+        for s in spans:
+            if s.parent_id is not None:
+                children[s.parent_id] = children.get(s.parent_id, 0) + (s.duration or 0)
+        stages = [s for s in spans if s is not root]
+        if not stages:
+            return
+        hot = max(stages, key=lambda s: (s.duration or 0) - children.get(s.span_id, 0))
+        self_time = (hot.duration or 0) - children.get(hot.span_id, 0)
+        print(f" [Trace] {root.name} took {root.duration:.2f}s over {len(spans)} span(s); "
+              f"hot stage: {hot.name} ({self_time:.2f}s). Trace {root.trace_id} in {self.path}")
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a child of the current span, or as the
+    root of a new trace. Yields the span so callers can attach bytes,
+    tokens and other attributes.
+    """
+    if not _tracer.enabled:
+        yield _NoopSpan()
+        return
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    _tracer.started(current)
+    _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.finish()
+        # Restore by value, not token: generators may resume in another context
+        _current_span.set(parent)
+        _tracer.finished(current)
+
+
+def record(name, duration, **attributes):
+    """
+    Adds an already measured span under the current one, for work timed
+    elsewhere (e.g. in a worker process or across generator yields).
+    """
+    if not _tracer.enabled:
+        return
+    current = Span(name, _current_span.get(), attributes)
+    current.start = time.time() - duration
+    current.finish(duration)
+    _tracer.finished(current)
+
+
+def current_span():
+    return _current_span.get() or _NoopSpan()
+
+
+def bind(func):
+    """
+    Runs func in the caller's tracing context. Needed for thread pools,
+    which unlike asyncio.to_thread do not carry context variables over.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
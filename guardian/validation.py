@@ -0,0 +1,197 @@
+import os
+from collections import Counter
+from .analyzer import AnalysisError
+from .metrics import FIX_BLOCKS
+from .patch_engine import apply_blocks
+from .tracing import span
+
+
+def _normalize(line):
+    return " ".join(line.split())
+
+
+def _line_at(content, line_number):
+    lines = content.splitlines()
+    return _normalize(lines[line_number - 1]) if line_number and 0 < line_number <= len(lines) else ""
+
+
+def _compiles(content, path):
+    try:
+        compile(content, path, "exec", dont_inherit=True)
+        return True
+    except (SyntaxError, ValueError):
+        return False
+
+
+class FileFix:
+    """
+    A patched file waiting for validation: its content before the fix,
+    the SEARCH/REPLACE blocks applied to it (in order) and the findings
+    they target. Validation drops blocks from kept; content always holds
+    the original with exactly the kept blocks applied.
+    """
+
+    def __init__(self, path, original, blocks, issues, regions=None):
+        self.path = path
+        self.original = original
+        self.blocks = list(blocks)
+        self.issues = issues
+        self.regions = regions
+        self.unresolved = []
+        self.introduced = []
+        self.rebuild(self.blocks)
+
+    @property
+    def changed(self):
+        return self.content != self.original
+
+    @property
+    def reverted(self):
+        return len(self.blocks) - len(self.kept)
+
+    def rebuild(self, blocks):
+        engine = apply_blocks(self.original, blocks, self.regions,
+                              [issue.get("line_number") for issue in self.issues])
+        self.content = engine.content
+        self.kept = engine.applied
+        self.spans = engine.spans
+
+
+class FixValidator:
+    """
+    Validates patched files in one batch, in process:
+
+    1. Syntax: every file must compile(). If one does not, its blocks are
+       re-applied one at a time and only those that keep it compiling stay.
+    2. Semantics (when an analyzer is given): the patched files are scanned
+       again in one analyzer run. A block is reverted if a targeted finding
+       is still reported inside it, or if a new finding of a blocking
+       severity appears inside it.
+
+    Findings are compared by (test id, normalized source line) since fixes
+    shift line numbers. Reverts are per block, never the whole file unless
+    no block survives.
+    """
+
+    def __init__(self, analyzer=None, rescan=None, blocking_severities=None):
+        self.analyzer = analyzer
+        self.rescan = rescan if rescan is not None else os.getenv("GUARDIAN_VALIDATE_RESCAN", "1") != "0"
+        severities = blocking_severities or os.getenv("GUARDIAN_VALIDATE_SEVERITY", "MEDIUM,HIGH").split(",")
+        self.blocking_severities = {s.strip().upper() for s in severities if s.strip()}
+
+    def validate(self, repo_path, fixes):
+        """
+        Validates fixes and writes each file's surviving content to disk.
+        The files must still hold their original content when this is
+        called, so the analyzer can take a baseline. Returns the fixes.
+        """
+        with span("validate", files=len(fixes)) as s:
+            for fix in fixes:
+                self._check_syntax(fix)
+
+            live = [fix for fix in fixes if fix.changed]
+            if live and self.rescan and self.analyzer is not None:
+                try:
+                    self._check_findings(repo_path, live)
+                except AnalysisError as e:
+                    print(f" [Validate] Re-scan failed, keeping syntax-checked fixes: {e}")
+
+            self._write(fixes)
+            blocks = sum(len(fix.blocks) for fix in fixes)
+            kept = sum(len(fix.kept) for fix in fixes)
+            s.set(blocks=blocks, kept=kept)
+            FIX_BLOCKS.inc(kept, outcome="kept")
+            FIX_BLOCKS.inc(blocks - kept, outcome="reverted")
+        for fix in fixes:
+            rel_path = os.path.relpath(fix.path, repo_path)
+            if not fix.changed:
+                print(f" [Validate] {rel_path}: no block passed validation, file left unchanged.")
+            elif fix.reverted:
+                print(f" [Validate] {rel_path}: kept {len(fix.kept)} of {len(fix.blocks)} block(s).")
+            else:
+                print(f" [Validate] {rel_path}: all {len(fix.kept)} block(s) validated.")
+        return fixes
+
+    def _check_syntax(self, fix):
+        if not fix.changed or _compiles(fix.content, fix.path):
+            return
+        print(f" [Validate] {os.path.basename(fix.path)} does not compile; checking blocks one by one...")
+        kept = []
+        for block in fix.kept:
+            candidate = apply_blocks(fix.original, kept + [block], fix.regions,
+                                     [issue.get("line_number") for issue in fix.issues])
+            if len(candidate.applied) == len(kept) + 1 and _compiles(candidate.content, fix.path):
+                kept.append(block)
+        fix.rebuild(kept)
+
+    def _check_findings(self, repo_path, fixes):
+        baseline = self._scan(repo_path, fixes)
+        # Each round drops at least one block, so this ends after at most max(blocks) rounds
+        while fixes:
+            self._write(fixes)
+            after = self._scan(repo_path, fixes)
+            retry = []
+            for fix in fixes:
+                key = os.path.abspath(fix.path)
+                if self._judge(fix, baseline.get(key, []), after.get(key, [])):
+                    self._check_syntax(fix)
+                    if fix.changed:
+                        retry.append(fix)
+            fixes = retry
+
+    def _scan(self, repo_path, fixes):
+        """Findings per absolute path, from one analyzer run over every file in fixes."""
+        files = [os.path.relpath(fix.path, repo_path) for fix in fixes]
+        with span("validate.rescan", files=len(files)):
+            results = self.analyzer.run_bandit(repo_path, files=files)
+        if isinstance(results, dict):
+            raise AnalysisError(results.get("error"))
+        by_path = {}
+        for issue in results:
+            by_path.setdefault(os.path.abspath(issue["filename"]), []).append(issue)
+        return by_path
+
+    def _judge(self, fix, before, after):
+        """
+        Records unresolved and introduced findings for fix and drops the
+        blocks responsible for them. Returns True if any block was dropped.
+        """
+        remaining = Counter((i.get("test_id"), _line_at(fix.original, i["line_number"])) for i in before)
+        new = []
+        for issue in after:
+            signature = (issue.get("test_id"), _line_at(fix.content, issue["line_number"]))
+            if remaining[signature]:
+                remaining[signature] -= 1
+            else:
+                new.append(issue)
+
+        targeted = {(issue.get("test_id"), _line_at(fix.original, issue.get("line_number"))) for issue in fix.issues}
+        fix.unresolved = [i for i in after
+                          if (i.get("test_id"), _line_at(fix.content, i["line_number"])) in targeted
+                          or (None, _line_at(fix.content, i["line_number"])) in targeted]
+        blocking = [i for i in new if (i.get("severity") or "").upper() in self.blocking_severities]
+        fix.introduced = [i for i in new if i not in blocking]
+
+        offending = set()
+        culprits = set()
+        for issue in blocking + fix.unresolved:
+            lines = issue.get("line_range") or [issue["line_number"]]
+            hits = {k for k, (start, end) in enumerate(fix.spans) if any(start <= l <= end for l in lines)}
+            if issue in blocking and not hits:
+                # A new finding outside every block can only come from their combination
+                hits = set(range(len(fix.kept)))
+            if hits:
+                offending |= hits
+                culprits.add(issue.get("test_id") or "?")
+        if not offending:
+            return False
+
+        print(f" [Validate] {os.path.basename(fix.path)}: reverting {len(offending)} block(s) "
+              f"({', '.join(sorted(culprits))} still reported or introduced).")
+        fix.rebuild([block for k, block in enumerate(fix.kept) if k not in offending])
+        return True
+
+    def _write(self, fixes):
+        for fix in fixes:
+            with open(fix.path, 'w') as f:
+                f.write(fix.content)
@@ -0,0 +1,65 @@
+"""
+Compares the two orchestration modes of run_guardian_on_pr on one PR:
+"pipeline" (steps run in code, LLM only for fixes) and "agent" (the ADK
+agent plans every tool call). Reports wall time, LLM calls and tokens.
+
+Runs in dry-run mode by default (nothing is pushed or commented) so every
+run sees the same PR. Combine with the local LLM stand-in for fix
+generation to benchmark offline; agent mode still needs a Gemini key for
+its planning turns.
+
+    BENCH_PR=1 BENCH_BRANCH=feat/add-vulnerable-feature BENCH_RUNS=5 python ops/bench_orchestrators.py
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("GUARDIAN_DRY_RUN", "1")
+
+from guardian.adk_agent import run_guardian_on_pr
+
+# Configuration
+REPO_URL = os.getenv("BENCH_REPO_URL", "http://localhost:3000/guardian_admin/vulnerable-repo.git")
+REPO_OWNER = os.getenv("BENCH_REPO_OWNER", "guardian_admin")
+REPO_NAME = os.getenv("BENCH_REPO_NAME", "vulnerable-repo")
+PR_NUMBER = int(os.getenv("BENCH_PR", 1))
+BRANCH_NAME = os.getenv("BENCH_BRANCH", "feat/add-vulnerable-feature")
+BASE_BRANCH = os.getenv("BENCH_BASE", "main")
+RUNS = int(os.getenv("BENCH_RUNS", 3))
+MODES = [m.strip() for m in os.getenv("BENCH_MODES", "pipeline,agent").split(",") if m.strip()]
+OUTPUT = os.getenv("BENCH_OUTPUT")  # Optional path for the raw run summaries as JSON
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def bench():
+    runs = {mode: [] for mode in MODES}
+    for mode in MODES:
+        for i in range(RUNS):
+            print(f"\n=== {mode} run {i + 1}/{RUNS} ===")
+            summary = await run_guardian_on_pr(REPO_URL, REPO_OWNER, REPO_NAME, PR_NUMBER, BRANCH_NAME,
+                                               base_branch=BASE_BRANCH, mode=mode)
+            runs[mode].append(summary)
+
+    print(f"\nPR #{PR_NUMBER} in {REPO_NAME}, {RUNS} run(s) per mode")
+    print(f"{'mode':<10}{'p50 s':>8}{'p95 s':>8}{'calls':>8}{'prompt tok':>12}{'output tok':>12}{'errors':>8}")
+    for mode, summaries in runs.items():
+        seconds = [s["seconds"] for s in summaries]
+        print(f"{mode:<10}{percentile(seconds, 50):>8.1f}{percentile(seconds, 95):>8.1f}"
+              f"{statistics.mean(s['calls'] for s in summaries):>8.1f}"
+              f"{statistics.mean(s['prompt_tokens'] for s in summaries):>12.0f}"
+              f"{statistics.mean(s['output_tokens'] for s in summaries):>12.0f}"
+              f"{sum(1 for s in summaries if s.get('error')):>8}")
+
+    if OUTPUT:
+        with open(OUTPUT, "w") as f:
+            json.dump(runs, f, indent=2, default=str)
+        print(f"Raw summaries written to {OUTPUT}")
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,272 @@
+"""
+Local deterministic stand-in for the LLM, for load and regression runs
+without a Gemini key.
+
+It answers the prompts built by LLMClient with rule-based SEARCH/REPLACE
+blocks for the finding types Bandit reports most often. The same prompt
+always gets the same answer; latency and failures are injected from a
+seeded random generator.
+
+    STANDIN_LATENCY_MS=800 STANDIN_ERROR_RATE=0.05 python ops/llm_standin.py
+    GUARDIAN_LLM_BACKEND=http GUARDIAN_LLM_URL=http://localhost:8090 python -m guardian.server
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from flask import Flask, Response, jsonify, request
+
+# Configuration
+PORT = int(os.getenv("STANDIN_PORT", 8090))
+LATENCY_MS = float(os.getenv("STANDIN_LATENCY_MS", 500))   # Base latency per request
+JITTER_MS = float(os.getenv("STANDIN_JITTER_MS", 250))     # Uniform extra latency on top of the base
+ERROR_RATE = float(os.getenv("STANDIN_ERROR_RATE", 0))     # Share of requests answered with HTTP 503
+HANG_RATE = float(os.getenv("STANDIN_HANG_RATE", 0))       # Share of requests that stall for HANG_MS
+HANG_MS = float(os.getenv("STANDIN_HANG_MS", 120000))
+SEED = int(os.getenv("STANDIN_SEED", 1234))
+
+app = Flask(__name__)
+_rng = random.Random(SEED)
+_lock = threading.Lock()
+stats = {"requests": 0, "errors": 0, "hangs": 0, "blocks": 0}
+
+IMPORT_LINE = re.compile(r"^(import|from)\s+\S+")
+EXPR = r"[\w.\[\]()]+"
+
+
+# --- Rules -------------------------------------------------------------------
+#
+# Each rule takes the code lines and the index of the flagged line and
+# returns ({line index: new line}, modules to import), or None if the line
+# does not look like something the rule knows how to fix.
+
+def _line_rule(fix, imports=()):
+    def rule(lines, index):
+        new_line = fix(lines[index])
+        if new_line is None or new_line == lines[index]:
+            return None
+        return {index: new_line}, set(imports)
+    return rule
+
+def _sub_rule(pattern, replacement, imports=()):
+    return _line_rule(lambda line: re.sub(pattern, replacement, line) if re.search(pattern, line) else None, imports)
+
+def _parameterize(text):
+    """
+    Turns string-built SQL into a '?' placeholder query. Returns
+    (new text, [parameter expressions]) or None.
+    """
+    params = []
+
+    def take(match):
+        params.append(match.group(1))
+        return "?"
+
+    # "... '" + name + "' ..." and "... " + name + " ..."
+    new = re.sub(r"'\"\s*\+\s*(" + EXPR + r")\s*\+\s*\"'", take, text)
+    new = re.sub(r"\"\s*\+\s*(" + EXPR + r")\s*\+\s*\"", take, new)
+    # "... '" + name  /  "... " + name at the end of the expression
+    new = re.sub(r"'?\"\s*\+\s*(" + EXPR + r")(?=\s*(?:\)|,|$))", lambda m: take(m) + '"', new)
+    # f"... '{name}' ..."
+    fstring = re.search(r"\bf([\"'])(.*?)\1", new)
+    if fstring:
+        body = re.sub(r"'?\{(" + EXPR + r")\}'?", take, fstring.group(2))
+        quote = fstring.group(1)
+        new = new[:fstring.start()] + quote + body + quote + new[fstring.end():]
+    # "... '%s' ..." % (a, b)
+    percent = re.search(r"([\"'])(.*?)\1\s*%\s*(\(.*\)|" + EXPR + r")", new)
+    if not params and percent:
+        body = re.sub(r"'?%s'?", "?", percent.group(2))
+        args = percent.group(3)
+        params.extend(a.strip() for a in args.strip("()").split(",") if a.strip())
+        quote = percent.group(1)
+        new = new[:percent.start()] + quote + body + quote + new[percent.end():]
+    if not params:
+        return None
+    return new, params
+
+def _param_tuple(params):
+    return "(" + ", ".join(params) + ("," if len(params) == 1 else "") + ")"
+
+def fix_sql(lines, index):
+    line = lines[index]
+    parsed = _parameterize(line)
+    if parsed is None:
+        return None
+    new_line, params = parsed
+    execute = re.search(r"\.execute\((.*)\)", new_line)
+    if execute:
+        return {index: new_line[:execute.end() - 1] + f", {_param_tuple(params)})" + new_line[execute.end():]}, set()
+
+    # query = "..." on one line, cursor.execute(query) further down
+    assignment = re.match(r"\s*(\w+)\s*=", line)
+    if not assignment:
+        return None
+    name = assignment.group(1)
+    for j in range(index + 1, min(len(lines), index + 20)):
+        call = re.search(r"\.execute\(\s*" + name + r"\s*\)", lines[j])
+        if call:
+            fixed_call = lines[j][:call.end() - 1] + f", {_param_tuple(params)})" + lines[j][call.end():]
+            return {index: new_line, j: fixed_call}, set()
+    return None
+
+def _fix_os_system(line):
+    match = re.search(r"os\.system\((.*)\)", line)
+    if not match:
+        return None
+    arg = match.group(1).strip()
+    simple = re.match(r"^[\"'](\w+) [\"']\s*\+\s*(" + EXPR + r")$", arg)
+    args = f'["{simple.group(1)}", {simple.group(2)}]' if simple else f"shlex.split({arg})"
+    return line[:match.start()] + f"subprocess.run({args}, check=False)" + line[match.end():]
+
+def _fix_hardcoded_secret(line):
+    assignment = re.match(r"^(\s*)([A-Za-z_]\w*)\s*=\s*([\"']).*\3\s*$", line)
+    if assignment:
+        indent, name = assignment.group(1), assignment.group(2)
+        return f'{indent}{name} = os.environ.get("{name.upper()}", "")'
+    return re.sub(r"\b(\w*(?:pass|pwd|secret|token|key)\w*)\s*=\s*([\"'])[^\"']*\2",
+                  lambda m: f'{m.group(1)}=os.environ.get("{m.group(1).upper()}", "")', line, flags=re.I)
+
+def _fix_requests_timeout(line):
+    if "timeout" in line:
+        return None
+    return re.sub(r"(requests\.(?:get|post|put|patch|delete|head|request)\(.*)\)", r"\1, timeout=10)", line)
+
+fix_shell = _line_rule(_fix_os_system, ("subprocess", "shlex"))
+
+RULES = {
+    "B608": fix_sql,
+    "B605": fix_shell,
+    "B602": _sub_rule(r"shell\s*=\s*True", "shell=False"),
+    "B604": _sub_rule(r"shell\s*=\s*True", "shell=False"),
+    "B301": _sub_rule(r"\b(?:c?[Pp]ickle)\.load(s?)\(", r"json.load\1(", ("json",)),
+    "B403": _sub_rule(r"^(\s*)import c?[Pp]ickle\s*$", r"\1import json"),
+    "B307": _sub_rule(r"(?<![\w.])eval\(", "ast.literal_eval(", ("ast",)),
+    "B506": _line_rule(lambda l: re.sub(r",\s*Loader\s*=\s*[\w.]+", "", l.replace("yaml.load(", "yaml.safe_load("))),
+    "B105": _line_rule(_fix_hardcoded_secret, ("os",)),
+    "B106": _line_rule(_fix_hardcoded_secret, ("os",)),
+    "B324": _sub_rule(r"hashlib\.(?:md5|sha1)\(", "hashlib.sha256("),
+    "B501": _sub_rule(r"verify\s*=\s*False", "verify=True"),
+    "B104": _sub_rule(r"([\"'])0\.0\.0\.0\1", '"127.0.0.1"'),
+    "B201": _sub_rule(r"debug\s*=\s*True", "debug=False"),
+    "B113": _line_rule(_fix_requests_timeout),
+    "B108": _sub_rule(r"([\"'])/tmp/([^\"']*)\1", r'os.path.join(tempfile.gettempdir(), "\2")', ("os", "tempfile")),
+    "B311": _sub_rule(r"\brandom\.(random|randint|choice|randrange)\(", r"secrets.SystemRandom().\1(", ("secrets",)),
+}
+
+
+# --- Prompt handling ---------------------------------------------------------
+
+def parse_prompt(prompt):
+    """
+    Pulls the findings and the code out of a prompt built by LLMClient.
+    Returns ([(line number, test id or None)], code).
+    """
+    report = re.search(r"Vulnerability Report:\n(.*?)\n\s*Vulnerable Code:", prompt, re.S)
+    code = re.search(r"```python\n(.*)\n[ \t]*```\s*\n\s*Task:", prompt, re.S)
+    findings = []
+    if report:
+        for line, test_id in re.findall(r"Line (\d+)(?: \[(B\d+)\])?", report.group(1)):
+            findings.append((int(line), test_id or None))
+    # The prompt template indents the first line of the code
+    return findings, code.group(1).lstrip(" ") if code else ""
+
+def answer(prompt):
+    """
+    SEARCH/REPLACE blocks fixing every finding a rule knows about. Line
+    numbers refer to the whole file, so when the code is an excerpt the
+    flagged line is located by pattern instead.
+    """
+    findings, code = parse_prompt(prompt)
+    lines = code.split("\n")
+    edits = {}
+    imports = set()
+    for line_number, test_id in findings:
+        index = line_number - 1
+        candidates = [index] if 0 <= index < len(lines) else []
+        if test_id in RULES:
+            rules = [RULES[test_id]]
+            candidates += range(len(lines))
+        else:
+            rules = list(RULES.values())
+        for rule in rules:
+            result = next((r for r in (rule(lines, i) for i in candidates if i not in edits) if r), None)
+            if result:
+                edits.update(result[0])
+                imports |= result[1]
+                break
+
+    blocks = [(lines[i], new) for i, new in sorted(edits.items())]
+    missing = sorted(m for m in imports if not any(re.match(rf"\s*import {m}\s*$", l) for l in lines))
+    if missing:
+        anchor = next((i for i, l in enumerate(lines) if IMPORT_LINE.match(l)), None)
+        if anchor is not None and anchor not in edits:
+            new_imports = "".join(f"import {m}\n" for m in missing)
+            blocks.insert(0, (lines[anchor], new_imports + lines[anchor]))
+
+    return "\n".join(f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE" for search, replace in blocks)
+
+def _draw():
+    """Latency in seconds and failure mode for one request."""
+    with _lock:
+        stats["requests"] += 1
+        roll = _rng.random()
+        delay = (LATENCY_MS + JITTER_MS * _rng.random()) / 1000
+        if roll < ERROR_RATE:
+            stats["errors"] += 1
+            return delay, "error"
+        if roll < ERROR_RATE + HANG_RATE:
+            stats["hangs"] += 1
+            return HANG_MS / 1000, "hang"
+        return delay, None
+
+
+# --- Routes ------------------------------------------------------------------
+
+@app.route('/v1/models', methods=['GET'])
+def models():
+    return jsonify({"models": ["models/standin"]})
+
+@app.route('/v1/stats', methods=['GET'])
+def get_stats():
+    with _lock:
+        return jsonify(dict(stats))
+
+@app.route('/v1/generate', methods=['POST'])
+def generate():
+    data = request.get_json(silent=True) or {}
+    delay, failure = _draw()
+    if failure == "error":
+        time.sleep(delay / 2)
+        return jsonify({"error": "injected failure"}), 503
+    if failure == "hang":
+        time.sleep(delay)
+        return jsonify({"error": "injected stall"}), 504
+
+    text = answer(data.get("prompt", ""))
+    with _lock:
+        stats["blocks"] += text.count(">>>>>>> REPLACE")
+
+    if not data.get("stream"):
+        time.sleep(delay)
+        return jsonify({"text": text})
+
+    chunks = re.split(r"(?<=>>>>>>> REPLACE)\n", text) if text else [""]
+
+    def stream():
+        # Half the latency before the first chunk, the rest spread over the others
+        time.sleep(delay / 2)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(delay / 2 / len(chunks))
+            yield json.dumps({"text": chunk + ("\n" if i < len(chunks) - 1 else "")}) + "\n"
+
+    return Response(stream(), mimetype="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    print(f"LLM stand-in on port {PORT} (latency {LATENCY_MS:.0f}+{JITTER_MS:.0f}ms, "
+          f"errors {ERROR_RATE:.0%}, stalls {HANG_RATE:.0%}, seed {SEED})")
+    app.run(host="127.0.0.1", port=PORT, threaded=True)
@@ -0,0 +1,51 @@
+from guardian.cache import DiskCache
+from guardian.fix_cache import FixCache
+from guardian.patch_engine import apply_blocks
+
+CONTENT = (
+    "import os\n"
+    "\n"
+    "\n"
+    "def run(cmd):\n"
+    "    print(cmd)\n"
+    "    os.system(cmd)\n"
+    "    return cmd\n"
+)
+ISSUE = {"test_id": "B605", "line_number": 6}
+# The import is far from the finding; replaying the call alone would raise NameError
+BLOCKS = [
+    ("import os", "import os\nimport subprocess"),
+    ("    os.system(cmd)", "    subprocess.run(cmd.split(), check=True)"),
+]
+
+
+def make_cache(tmp_path):
+    return FixCache(DiskCache("fixes", db_path=str(tmp_path / "cache.db")))
+
+
+def test_replays_every_block_of_the_fix(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store(ISSUE, CONTENT, BLOCKS)
+
+    blocks = cache.lookup(ISSUE, CONTENT)
+    assert blocks == BLOCKS
+    fixed = apply_blocks(CONTENT, blocks).content
+    assert "import subprocess\n" in fixed
+    assert "subprocess.run(cmd.split(), check=True)" in fixed
+
+
+def test_fix_is_not_replayed_when_one_block_no_longer_applies(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store(ISSUE, CONTENT, BLOCKS)
+
+    # Same signature (the lines around the finding are unchanged), but the import moved on
+    changed = CONTENT.replace("import os\n", "import os, sys\n")
+    assert cache.signature(ISSUE, changed) == cache.signature(ISSUE, CONTENT)
+    assert cache.lookup(ISSUE, changed) is None
+    assert cache.stale == 1
+
+
+def test_fix_that_does_not_apply_is_not_stored(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.store(ISSUE, CONTENT, BLOCKS + [("not in the file", "x = 1")])
+    assert cache.lookup(ISSUE, CONTENT) is None
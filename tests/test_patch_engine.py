@@ -0,0 +1,85 @@
+from guardian.patch_engine import PatchEngine, apply_blocks
+from guardian.validation import FileFix
+
+
+def compiles(source):
+    compile(source, "<patched>", "exec")
+    return True
+
+
+def test_exact_block_is_applied():
+    engine = apply_blocks("a = 1\nb = eval(s)\n", [("b = eval(s)", "b = int(s)")])
+    assert engine.content == "a = 1\nb = int(s)\n"
+    assert engine.spans == [(2, 2)]
+    assert not engine.failed
+
+
+def test_dedented_block_keeps_each_line_at_its_own_depth():
+    content = "def a():\n    pass\n\ndef b():\n    x = eval(s)\n    return x\n"
+    search = "def b():\nx = eval(s)\nreturn x"
+    replace = "def b():\ny = 1\nreturn y"
+    engine = apply_blocks(content, [(search, replace)])
+    assert engine.content == "def a():\n    pass\n\ndef b():\n    y = 1\n    return y\n"
+    assert compiles(engine.content)
+
+
+def test_dedented_block_with_new_nesting():
+    content = "def b():\n    x = eval(s)\n    return x\n"
+    search = "x = eval(s)\nreturn x"
+    replace = "try:\n    x = literal_eval(s)\nexcept ValueError:\n    x = None\nreturn x"
+    engine = apply_blocks(content, [(search, replace)])
+    assert engine.content == ("def b():\n    try:\n        x = literal_eval(s)\n    except ValueError:\n"
+                              "        x = None\n    return x\n")
+    assert compiles(engine.content)
+
+
+def test_ambiguous_indentation_fails_the_block():
+    content = "def b():\n    x = eval(s)\n"
+    # The outdented line has no SEARCH line at its depth to map from
+    search = "    def b():\n    x = eval(s)"
+    replace = "    def b():\n  x = int(s)"
+    engine = apply_blocks(content, [(search, replace)])
+    assert engine.content == content
+    assert engine.failed == [(search, replace)]
+
+
+def test_duplicate_is_resolved_by_the_nearest_anchor():
+    content = "x = eval(a)\nprint(x)\n\nx = eval(a)\nprint(x)\n"
+    engine = apply_blocks(content, [("x = eval(a)", "x = int(a)")], anchors=[4])
+    assert engine.content == "x = eval(a)\nprint(x)\n\nx = int(a)\nprint(x)\n"
+    assert engine.spans == [(4, 4)]
+
+
+def test_crlf_line_endings_are_preserved():
+    content = "def f(s):\r\n    return eval(s)\r\n"
+    engine = apply_blocks(content, [("def f(s):\nreturn eval(s)", "def f(s):\nreturn int(s)")])
+    assert engine.content == "def f(s):\r\n    return int(s)\r\n"
+
+    # Validation re-applies the applied blocks to the original
+    content = "def f(s):\r\n    x = 1\r\n    return eval(s)\r\n"
+    engine = apply_blocks(content, [("x = 1\nreturn eval(s)", "x = 2\nreturn int(s)")])
+    assert engine.content == "def f(s):\r\n    x = 2\r\n    return int(s)\r\n"
+    fix = FileFix("f.py", content, engine.applied, [])
+    assert fix.content == engine.content
+    assert not fix.reverted
+
+
+def test_match_must_start_inside_a_region():
+    content = "x = eval(a)\ny = 1\nx = eval(a)\n"
+    engine = apply_blocks(content, [("x = eval(a)", "x = int(a)")], regions=[(2, 3)])
+    assert engine.content == "x = eval(a)\ny = 1\nx = int(a)\n"
+
+    engine = apply_blocks(content, [("x = eval(a)", "x = int(a)")], regions=[(2, 2)])
+    assert engine.content == content
+    assert len(engine.failed) == 1
+
+
+def test_regions_and_spans_follow_earlier_edits():
+    content = "a = eval(s)\nb = 1\nc = eval(s)\n"
+    engine = PatchEngine(content, regions=[(1, 1), (3, 3)])
+    assert engine.apply("a = eval(s)", "import ast\na = ast.literal_eval(s)")
+    # Line 3 moved to line 4; its region moved with it
+    assert engine.regions == [(1, 2), (4, 4)]
+    assert engine.apply("c = eval(s)", "c = ast.literal_eval(s)")
+    assert engine.spans == [(1, 2), (4, 4)]
+    assert engine.content == "import ast\na = ast.literal_eval(s)\nb = 1\nc = ast.literal_eval(s)\n"